@@ -1,18 +1,26 @@
 import openai
 import tiktoken
 import json
+import logging
 from pathlib import Path
 from src.utils.sys_utils import create_dirs, setup_logging, calculate_token_cost
 
 class Chatbot:
     COST_PER_TOKEN = {'gpt-3.5-turbo': 0.004, 'gpt-4': 0.03}
+    # Chat format overhead: every message is wrapped in a few tokens, and the reply is primed with a few more
+    TOKENS_PER_MESSAGE = 3
+    TOKENS_PER_REPLY = 3
 
     def __init__(self, openai_key, system_prompt=None, model="gpt-3.5-turbo", encoding="cl100k_base", chat_history_path='chat_history.json', debug=False):
         self.system_prompt = system_prompt
         self.model = model
         self.encoding = encoding
-        self.messages = self.load_system_prompt()
         self.encoder = tiktoken.get_encoding(self.encoding)
+        self.messages = []
+        self.context_tokens = 0
+        self.usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        for message in self.load_system_prompt():
+            self.add_message(**message)
         self.chat_history_path = Path(chat_history_path)
         openai.api_key = openai_key
         self.debug = debug
@@ -26,6 +34,17 @@ class Chatbot:
     def load_system_prompt(self):
         return [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
 
+    def count_message_tokens(self, message):
+        return self.TOKENS_PER_MESSAGE + sum(len(self.encoder.encode(value)) for value in message.values())
+
+    def add_message(self, role, content):
+        # Counted once here, so used_tokens never re-encodes the conversation
+        message = {"role": role, "content": content}
+        tokens = self.count_message_tokens(message)
+        self.messages.append(message)
+        self.context_tokens += tokens
+        return tokens
+
     def get_prompt(self, user_input):
         return self.messages + [{"role": "user", "content": user_input}]
 
@@ -35,19 +54,39 @@ class Chatbot:
                 model=self.model,
                 messages=self.get_prompt(user_input),
             )
-            self.messages.append({"role": "assistant", "content": completion.choices[0].message.content})
-            return completion.choices[0].message.content
+            content = completion.choices[0].message.content
+
+            self.add_message("user", user_input)
+            prompt_estimate = self.context_tokens + self.TOKENS_PER_REPLY
+            completion_estimate = self.add_message("assistant", content) - self.TOKENS_PER_MESSAGE
+            self.record_usage(completion.get('usage'), prompt_estimate, completion_estimate)
+            return content
         except Exception as e:
             if self.debug:
                 logging.error(f"Error creating chat completion: {str(e)}")
             raise
 
+    def record_usage(self, usage, prompt_estimate, completion_estimate):
+        # Prefer the counts the API billed; fall back to the local estimate if the response has none
+        prompt_tokens = usage['prompt_tokens'] if usage else prompt_estimate
+        completion_tokens = usage['completion_tokens'] if usage else completion_estimate
+        self.usage['prompt_tokens'] += prompt_tokens
+        self.usage['completion_tokens'] += completion_tokens
+        self.usage['total_tokens'] += prompt_tokens + completion_tokens
+
     @property
     def used_tokens(self):
-        token_count = len(self.encoder.encode(" ".join([msg["content"] for msg in self.messages])))
+        """Tokens the conversation takes up in the next prompt, and their cost."""
+        token_count = self.context_tokens + self.TOKENS_PER_REPLY
         token_cost = calculate_token_cost(token_count, self.COST_PER_TOKEN.get(self.model, 0))
         return token_count, token_cost
 
+    @property
+    def session_cost(self):
+        """Tokens billed across every completion so far, and their cost."""
+        token_count = self.usage['total_tokens']
+        return token_count, calculate_token_cost(token_count, self.COST_PER_TOKEN.get(self.model, 0))
+
     def save_chat_history(self):
         try:
             self.chat_history_path.write_text(json.dumps(self.messages, indent=4))
@@ -80,7 +119,8 @@ class Chatbot:
             print("Bot:", completion)
             if count_tokens:
                 token_count, token_cost = self.used_tokens
-                print(f"Used Tokens: {token_count} ({token_cost:.6f} USD)")
+                billed_count, billed_cost = self.session_cost
+                print(f"Used Tokens: {token_count} ({token_cost:.6f} USD), billed this session: {billed_count} ({billed_cost:.6f} USD)")
 
     def non_interactive_chat(self, user_message, count_tokens):
         completion = self.add_chat_completion(user_message)
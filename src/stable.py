@@ -1,23 +1,35 @@
 import os
-import requests
 import yaml
-import time
 import json
-import itertools
+import requests
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from tqdm import tqdm
+from src.utils import http_client, json_utils
+from src.utils.image_utils import send_request, get_meta_data
 from src.utils.image_upload import ImageUploader
 from src.utils.response_processor import ResponseProcessor
+from src.utils.sweep_journal import SweepJournal
+from src.utils.sweep_planner import SweepPlanner
 from src.utils.sys_utils import str2list
 
 class StableAPI:
     BASE_URL = 'https://stablediffusionapi.com/api'
     CONFIG_PATH = './config/stable'
     HEADERS = {"Content-Type": "application/json"}
+    OUTPUT_DIR = './output/images/'
 
-    def __init__(self, api_key=None, yaml_path=None, debug=False):
+    def __init__(self, api_key=None, yaml_path=None, debug=False, max_workers=1, upload_workers=4, webhook=None, cache=None):
         self.api_key = api_key
         self.uploader = ImageUploader()
         self.yaml_path = yaml_path
         self.debug = debug
+        self.max_workers = max_workers
+        self.upload_workers = upload_workers
+        self.webhook = webhook  # a WebhookServer or a callback URL
+        self.cache = cache  # an optional RequestCache
 
     @staticmethod
     def _load_yaml(file):
@@ -25,7 +37,13 @@ class StableAPI:
             return yaml.safe_load(f)
 
     def _make_request(self, url, json_body):
-        response = requests.post(url=url, headers=self.HEADERS, json=json_body)
+        # A timeout or dropped connection fails this request only; None is treated as a failed response
+        try:
+            response = http_client.post(url, headers=self.HEADERS, json=json_body)
+        except requests.RequestException as e:
+            print(f"Request to {url} failed: {e}")
+            return None
+
         try:
             return response.json()
         except json.JSONDecodeError:
@@ -33,41 +51,149 @@ class StableAPI:
             return None
 
     def request(self, call=None, **kwargs):
+        # Image options may still be uploading when the sweep is pipelined
+        kwargs = self._resolve(kwargs)
         url = f'{self.BASE_URL}/v3/{call}'
         api_options = self._load_yaml(f'{self.CONFIG_PATH}/{call}.yml')
         api_options.update(kwargs)
         api_options['key'] = self.api_key
-        return self._make_request(url, api_options)
+        if self.webhook:
+            api_options['webhook'] = getattr(self.webhook, 'url', self.webhook)
 
-    def set_options(self, yaml_path=None):
+        cache_payload = {**api_options, 'call': call}
+        if self.cache:
+            cached = self.cache.get(cache_payload)
+            if cached:
+                return cached
+
+        response = self._make_request(url, api_options)
+        if self.cache and response and response.get('status') == 'success':
+            self.cache.put(cache_payload, response, self._local_paths(response))
+        elif self.cache and response and response.get('status') == 'processing' and self.cache.cacheable(cache_payload):
+            # Kept with the processing record, so the job is cached when it is fetched later
+            response['cache_key'] = self.cache.key(cache_payload)
+            response['cache_dir'] = str(self.cache.cache_dir)
+        return response
+
+    def _local_paths(self, response):
+        # Where ResponseProcessor saves the images of a successful response
+        return [os.path.join(self.OUTPUT_DIR, str(response['id']), os.path.basename(url)) for url in response.get('output', [])]
+
+    def set_options(self, yaml_path=None, pipeline=False):
         if yaml_path is None:
             yaml_path = self.yaml_path
         options = self.yml_to_options(yaml_path)
 
-        if options.get('init_image'):
-            self.upload_and_set_image(options, 'init_image')
-
-        if options.get('call') == "inpaint" and options.get('mask_image'):
-            self.upload_and_set_image(options, 'mask_image')
+        image_keys = ['init_image']
+        # yml_to_options turns every value into a list, including 'call'
+        if 'inpaint' in options.get('call', []):
+            image_keys.append('mask_image')
 
+        self.upload_images(options, [key for key in image_keys if options.get(key)], wait=not pipeline)
         return options
 
-    def run(self):
-        options = self.set_options()
-        responses, status = self.get_responses(options)
-        self.process_responses(responses)
+    def run(self, max_workers=None, pipeline=False, strategy='grid', samples=None, seed=0, shard=None,
+            resume=False, journal_path=None):
+        options = self.set_options(pipeline=pipeline)
+        planner = SweepPlanner(options, strategy=strategy, samples=samples, seed=seed, shard=shard)
+
+        journal = SweepJournal(journal_path or self.journal_path(shard), resume=resume)
+        combos = journal.pending(self._resolve(combo) for combo in planner)
+
+        # Each response is processed as soon as it arrives instead of after the whole sweep
+        for combo, response in self.iter_responses(combos, max_workers, journal):
+            if self.debug:
+                self.debug_responses([combo], [response])
+            self.process_responses([response])
+
+        if journal.skipped:
+            print(f"Resumed sweep: skipped {journal.skipped} completed combos")
+        if self.cache:
+            print(f"Request cache: {self.cache.stats}")
+
+    def journal_path(self, shard=None):
+        name = Path(self.yaml_path).stem if self.yaml_path else 'sweep'
+        if shard:
+            index, count = SweepPlanner.parse_shard(shard)
+            name = f'{name}_shard{index}of{count}'
+        return os.path.join(self.OUTPUT_DIR, 'sweeps', f'{name}.jsonl')
+
+    @staticmethod
+    def _resolve(combo):
+        return {k: v.result() if isinstance(v, Future) else v for k, v in combo.items()}
+
+    def _dispatch(self, combo, journal=None):
+        if journal is None:
+            return self.request(**combo)
+
+        entry = journal.entry(combo)
+        if entry and entry['event'] == 'processing' and entry.get('id') is not None:
+            response = self._repoll(entry['id'])
+        else:
+            journal.record(combo, 'dispatched')
+            response = self.request(**combo)
+
+        journal.record_response(combo, response)
+        return response
+
+    def _repoll(self, id):
+        # A combo that was still processing when the last run stopped; it is already in processing.json.
+        # FetchScheduler or the webhook may have completed it since, without the journal being told
+        completed = json_utils.lookup_record(os.path.join(self.OUTPUT_DIR, 'master.json'), id)
+        if completed and completed.get('status') == 'success':
+            return {**completed, 'resumed': True}
+
+        response = send_request(id, self.api_key)
+        if response is None:
+            return None
+        if response.get('status') == 'success':
+            # ResponseProcessor caches it and drops it from processing.json
+            response['meta'] = get_meta_data(id, Path(self.OUTPUT_DIR))
+        elif response.get('status') == 'processing':
+            response.update(id=id, resumed=True)
+        return response
+
+    def get_responses(self, options_dict, max_workers=None):
+        combos, responses = [], []
+        for combo, response in self.iter_responses(SweepPlanner(options_dict), max_workers):
+            combos.append(combo)
+            responses.append(response)
 
-    def get_responses(self, options_dict):
-        combos = [dict(zip(options_dict, v)) for v in itertools.product(*options_dict.values())]
-        responses = [self.request(**combo) for combo in combos]
         if self.debug:
             self.debug_responses(combos, responses)
-        return responses, responses[0]['status']
+        # Failed requests come back as None, so the status is taken from the first that didn't fail
+        status = next((response['status'] for response in responses if response is not None), None)
+        return responses, status
+
+    def iter_responses(self, combos, max_workers=None, journal=None):
+        """Yield (combo, response) pairs in combo order, pulling combos lazily from the iterable."""
+        max_workers = max_workers or self.max_workers
+
+        if max_workers <= 1:
+            for combo in combos:
+                yield combo, self._dispatch(combo, journal)
+            return
+
+        # Keep a bounded window of requests in flight and hand them back in submission order
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            window = deque()
+            for combo in combos:
+                window.append((combo, executor.submit(self._dispatch, combo, journal)))
+                if len(window) >= max_workers * 2:
+                    done_combo, future = window.popleft()
+                    yield done_combo, future.result()
+
+            while window:
+                done_combo, future = window.popleft()
+                yield done_combo, future.result()
 
     @staticmethod
     def debug_responses(combos, responses):
         for combo, response_data in zip(combos, responses):
             print(f'Rendering: {combo}')
+            if response_data is None:
+                print('Request failed\n')
+                continue
             status = response_data['status']
             if status == 'success':
                 print(f"{response_data['output']}\n")
@@ -75,18 +201,49 @@ class StableAPI:
                 print(f'Processing Image. Run fetch after {round(float(response_data["eta"]), 2)} sec.\n')
 
     def upload_and_set_image(self, options, image_key):
-        paths = options.get(image_key)
-        if not paths: return
-        if not isinstance(paths, list): paths = [paths]
-
-        uploaded_images = []
-        for path in paths:
-            if os.path.isfile(path):
-                # print(f'uploading {image_key}: {path}')
-                uploaded_images.append(self.uploader.upload_img(path))
-            else:
-                raise FileNotFoundError(f"No file found at {path}")
-        options[image_key] = uploaded_images
+        self.upload_images(options, [image_key])
+
+    def upload_images(self, options, image_keys, wait=True):
+        paths = {}
+        for image_key in image_keys:
+            key_paths = options.get(image_key)
+            if not key_paths: continue
+            if not isinstance(key_paths, list): key_paths = [key_paths]
+
+            for path in key_paths:
+                if not os.path.isfile(path):
+                    raise FileNotFoundError(f"No file found at {path}")
+            paths[image_key] = key_paths
+
+        # A path listed more than once, or under both keys, is uploaded once and its future shared
+        unique_paths = list(dict.fromkeys(path for key_paths in paths.values() for path in key_paths))
+        if not unique_paths: return
+
+        progress = tqdm(total=len(unique_paths), desc="Uploading images", unit="image")
+        remaining = [len(unique_paths)]
+        lock = threading.Lock()
+
+        def on_done(_):
+            # The last upload closes the bar, which in pipeline mode happens after upload_images returns
+            with lock:
+                progress.update()
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    progress.close()
+
+        executor = ThreadPoolExecutor(max_workers=self.upload_workers)
+        futures = {path: executor.submit(self.uploader.upload_img, path) for path in unique_paths}
+        for future in futures.values():
+            future.add_done_callback(on_done)
+        for image_key, key_paths in paths.items():
+            options[image_key] = [futures[path] for path in key_paths]
+
+        # Queued uploads keep running after shutdown(wait=False); in pipeline mode each
+        # request() blocks only on the futures of the images its own combo uses
+        executor.shutdown(wait=wait)
+        if wait:
+            for image_key in paths:
+                options[image_key] = [future.result() for future in options[image_key]]
 
     @staticmethod
     def yml_to_options(filename):
@@ -103,5 +260,7 @@ class StableAPI:
 
     def process_responses(self, results):
         for response_data in results:
-            ResponseProcessor(response_data).process()
-            time.sleep(1)
+            # Cached and resumed responses were already processed on an earlier run
+            if response_data is None or response_data.get('cached') or response_data.get('resumed'):
+                continue
+            ResponseProcessor(response_data, self.OUTPUT_DIR).process()
@@ -1,22 +1,37 @@
 from src.utils.image_upload import ImageUploader
 from src.utils.image_utils import image_download
-import requests
+from src.utils import http_client, json_utils, rate_limiter
+from src.utils.phash import PerceptualIndex
 import json
-import time
 import os
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 class APIUploader:
 
-    def __init__(self, stable_api_key, output_dir='./output/images/', scale=3):
+    API_HOST = 'stablediffusionapi.com'
+
+    def __init__(self, stable_api_key, output_dir='./output/images/', scale=3, requests_per_sec=1.0, burst=5):
         self.stable_api_key = stable_api_key
         self.image_uploader = ImageUploader()
         self.output_dir = output_dir
         self.scale = scale
         os.makedirs(self.output_dir, exist_ok=True)
         self.processed_urls = set()  # Set to store processed image URLs
-
-    def upload_and_process(self, img_path, delay_sec=5):
+        # Shared by every request to the API host, including StableAPI calls in this process
+        self.rate_limiter = rate_limiter.configure(self.API_HOST, requests_per_sec, burst)
+
+    @staticmethod
+    def _warn_delay_sec(delay_sec):
+        # Requests are paced by the shared rate limiter now, see requests_per_sec and burst
+        if delay_sec is not None:
+            warnings.warn('delay_sec is deprecated and ignored; pacing comes from requests_per_sec',
+                          DeprecationWarning, stacklevel=3)
+
+    def upload_and_process(self, img_path, delay_sec=None):
+        self._warn_delay_sec(delay_sec)
         # Upload the image and get the response URL
         response_url = self.image_uploader.upload_img(img_path)
 
@@ -28,6 +43,15 @@ class APIUploader:
         # Add the URL to the set of processed URLs
         self.processed_urls.add(response_url)
 
+        api_response = self.submit(response_url)
+        if api_response['status'] == 'success':
+            # Download the output image
+            output_image_url = self.get_output_url(api_response)
+            image_download(output_image_url, self.get_output_path(img_path, output_image_url))
+
+        return api_response
+
+    def submit(self, response_url):
         # Prepare the API payload with the response URL
         payload = json.dumps({
             "key": self.stable_api_key,
@@ -40,58 +64,138 @@ class APIUploader:
         # Make the API call
         url = "https://stablediffusionapi.com/api/v3/super_resolution"
         headers = {'Content-Type': 'application/json'}
-        response = requests.post(url, headers=headers, data=payload)
-
-        # Delay before the next API call
-        time.sleep(delay_sec)
+        response = http_client.post(url, headers=headers, data=payload)
 
         # Save the API response to master.json
-        master_json_path = os.path.join(self.output_dir, 'master.json')
-        with open(master_json_path, 'a') as f:
-            f.write(response.text + '\n')
-
-        # Process the API response
         api_response = json.loads(response.text)
-        if api_response['status'] == 'success':
-            # Download the output image
-            output_image_url = api_response['output']
-            output_image_name = os.path.basename(img_path).rsplit('.', 1)[0] + '_super.' + output_image_url.rsplit('.', 1)[1]
-            output_image_path = os.path.join(self.output_dir, output_image_name)
-            image_download(output_image_url, output_image_path)
-
+        json_utils.append_to_jsonl(api_response, os.path.join(self.output_dir, 'master.json'))
         return api_response
 
-    def process_batch(self, folder_path, delay_sec=5):
+    def poll(self, api_response):
+        headers = {'Content-Type': 'application/json'}
+        response = http_client.post(api_response['fetch_result'], headers=headers, json={"key": self.stable_api_key})
+        # Fetch responses may omit fetch_result, keep it so the job can be polled again
+        return {'fetch_result': api_response['fetch_result'], **response.json()}
+
+    @staticmethod
+    def get_output_url(api_response):
+        output = api_response['output']
+        return output[0] if isinstance(output, list) else output
+
+    def get_output_path(self, img_path, output_image_url):
+        output_image_name = os.path.basename(img_path).rsplit('.', 1)[0] + '_super.' + output_image_url.rsplit('.', 1)[1]
+        return os.path.join(self.output_dir, output_image_name)
+
+    def process_batch(self, folder_path, delay_sec=None, workers=4, max_in_flight=16, poll_interval=10, max_polls=30,
+                      skip_duplicates=False, duplicate_threshold=6):
+        """
+        Upscale every .jpg in folder_path through a staged pipeline.
+
+        Upload, submit, poll and download each run on their own thread pool, so one file can be
+        uploading while others are being submitted, awaited or downloaded. Jobs that come back
+        as 'processing' are re-polled on a timer instead of holding a worker. At most
+        max_in_flight files are in the pipeline at once. Files whose output already exists are skipped.
+        With skip_duplicates, only the first image of each cluster of near-duplicates is upscaled.
+        delay_sec is accepted for older callers and ignored.
+        """
+        self._warn_delay_sec(delay_sec)
         # Get the list of image files in the folder
-        image_files = [filename for filename in os.listdir(folder_path) if filename.endswith(".jpg")]
+        image_files = sorted(filename for filename in os.listdir(folder_path) if filename.endswith(".jpg"))
 
-        # Create a progress bar
-        progress_bar = tqdm(image_files, desc="Processing Images", unit="image")
-
-        # Iterate through all the image files in the folder
-        for filename in progress_bar:
-            # Construct the full path to the image
-            img_path = os.path.join(folder_path, filename)
+        duplicates = set()
+        if skip_duplicates:
+            index = PerceptualIndex(duplicate_threshold, workers=workers)
+            index.add_all(os.path.join(folder_path, filename) for filename in image_files)
+            for cluster in index.clusters():
+                duplicates.update(os.path.basename(path) for path in cluster[1:])
 
+        # Create a progress bar
+        progress_bar = tqdm(total=len(image_files), desc="Processing Images", unit="image")
+
+        stages = {name: ThreadPoolExecutor(max_workers=workers) for name in ('upload', 'submit', 'poll', 'download')}
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+        lock = threading.Lock()
+        remaining = [len(image_files)]
+        all_done = threading.Event()
+
+        def finish(filename, status):
+            with lock:
+                progress_bar.set_postfix({"Status": status, "File": filename})
+                progress_bar.update()
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    all_done.set()
+
+        def finish_in_flight(filename, status):
+            in_flight.release()
+            finish(filename, status)
+
+        def run_stage(stage, fn, filename, *args):
+            def task():
+                try:
+                    fn(filename, *args)
+                except Exception as e:
+                    print(f"Error processing {filename} during {stage}: {e}")
+                    finish_in_flight(filename, "error")
+            stages[stage].submit(task)
+
+        def upload(filename):
+            response_url = self.image_uploader.upload_img(os.path.join(folder_path, filename))
+            with lock:
+                duplicate = response_url in self.processed_urls
+                self.processed_urls.add(response_url)
+            if duplicate:
+                finish_in_flight(filename, "Skipped")
+                return
+            run_stage('submit', submit, filename, response_url)
+
+        def submit(filename, response_url):
+            handle(filename, self.submit(response_url), 0)
+
+        def poll(filename, api_response, polls):
+            handle(filename, self.poll(api_response), polls)
+
+        def handle(filename, api_response, polls):
+            status = api_response.get('status')
+            if status == 'success':
+                run_stage('download', download, filename, self.get_output_url(api_response))
+            elif status == 'processing' and polls < max_polls:
+                delay = max(poll_interval, float(api_response.get('eta') or 0))
+                timer = threading.Timer(delay, run_stage, ('poll', poll, filename, api_response, polls + 1))
+                timer.daemon = True
+                timer.start()
+            else:
+                finish_in_flight(filename, status or "error")
+
+        def download(filename, output_image_url):
+            path = image_download(output_image_url, self.get_output_path(os.path.join(folder_path, filename), output_image_url))
+            finish_in_flight(filename, "success" if path else "download failed")
+
+        for filename in image_files:
             # Check if the output image already exists
             output_image_name = os.path.splitext(filename)[0] + '_super.jpg'
-            output_image_path = os.path.join(self.output_dir, output_image_name)
-            if os.path.exists(output_image_path):
-                progress_bar.set_postfix({"Status": "Skipped", "File": filename})
+            if os.path.exists(os.path.join(self.output_dir, output_image_name)):
+                finish(filename, "Skipped")
+                continue
+            if filename in duplicates:
+                finish(filename, "Duplicate")
                 continue
 
-            # Upload and process the image
-            api_response = self.upload_and_process(img_path, delay_sec)
+            in_flight.acquire()
+            run_stage('upload', upload, filename)
 
-            # Update the progress bar description
-            progress_bar.set_postfix({"Status": api_response["status"], "File": filename})
+        if image_files:
+            all_done.wait()
+        for executor in stages.values():
+            executor.shutdown()
+        progress_bar.close()
 
-    def process_directory(self, directory_path, delay_sec=5):
+    def process_directory(self, directory_path, delay_sec=None):
+        self._warn_delay_sec(delay_sec)
         for root, dirs, _ in os.walk(directory_path):
             for dir in dirs:
-                time.sleep(delay_sec * 20)
                 folder_path = os.path.join(root, dir)
                 print(f'Upscale subfolder: {dir}')
                 self.output_dir = os.path.join(self.output_dir, dir)
                 os.makedirs(self.output_dir, exist_ok=True)
-                self.process_batch(folder_path, delay_sec)
+                self.process_batch(folder_path)
@@ -0,0 +1,164 @@
+# catalog.py
+
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from src.utils import json_utils
+from src.utils.file_cache import SharedByPath
+
+
+class OutputCatalog(SharedByPath):
+    """
+    SQLite index of Stable API results, so renders can be looked up by id or filtered by
+    prompt and parameters without opening the per-id JSON files or walking the output tree.
+
+    ResponseProcessor indexes every result as it arrives. index_tree backfills results that
+    were written before the catalog existed. query yields records shaped like the lines of
+    master.json, plus the local image paths, so they can be passed to img_to_grid and web_grid.
+
+    Attributes:
+    db_path (str): Path of the SQLite database file.
+    """
+
+    META_COLUMNS = {
+        'prompt': 'TEXT',
+        'negative_prompt': 'TEXT',
+        'guidance_scale': 'REAL',
+        'strength': 'REAL',
+        'seed': 'INTEGER',
+        'steps': 'INTEGER',
+        'H': 'INTEGER',
+        'W': 'INTEGER',
+    }
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        columns = ', '.join(f'"{name}" {kind}' for name, kind in self.META_COLUMNS.items())
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS renders (id TEXT PRIMARY KEY, status TEXT, date_time TEXT, {columns}, response TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS files (id TEXT, url TEXT, path TEXT, PRIMARY KEY (id, url))')
+            for name in ('status', 'prompt', 'strength', 'guidance_scale', 'seed'):
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS renders_{name} ON renders ("{name}")')
+
+    def index(self, response, paths=None):
+        """Insert or update one result. A success never gets downgraded by a late processing response."""
+        if response.get('id') is None:
+            return
+
+        id = str(response['id'])
+        meta = response.get('meta') or {}
+        row = [id, response.get('status'), response.get('date_time')]
+        row += [meta.get(name) for name in self.META_COLUMNS]
+
+        with self.lock:
+            existing = self.conn.execute('SELECT status, response FROM renders WHERE id = ?', (id,)).fetchone()
+            if existing and existing['status'] == 'success' and response.get('status') != 'success':
+                return
+            if existing and not meta:
+                # processing responses carry the meta, later fetch responses may not
+                response = {**json.loads(existing['response']), **response}
+                meta = response.get('meta') or {}
+                row[3:] = [meta.get(name) for name in self.META_COLUMNS]
+
+            with self.conn:
+                self.conn.execute(
+                    f'INSERT OR REPLACE INTO renders VALUES ({", ".join("?" * (len(row) + 1))})',
+                    row + [json.dumps(response, default=str)]
+                )
+                if paths is not None:
+                    self.conn.execute('DELETE FROM files WHERE id = ?', (id,))
+                    self.conn.executemany(
+                        'INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                        [(id, url, str(path) if path else None) for url, path in zip(response.get('output', []), paths)]
+                    )
+
+    def get(self, id):
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM renders WHERE id = ?', (str(id),)).fetchone()
+            return self._record(row) if row else None
+
+    def get_meta(self, id):
+        record = self.get(id)
+        return record.get('meta', {}) if record else None
+
+    def query(self, status='success', prompt_like=None, order_by='date_time', limit=None, **filters):
+        """
+        Yield the records matching every filter, e.g. query(strength=0.6, prompt='a cat').
+
+        Filters are META_COLUMNS names. A list or tuple value matches any of its items.
+        prompt_like is an SQL LIKE pattern, e.g. '%cat%'.
+        """
+        clauses, params = [], []
+        if status is not None:
+            clauses.append('status = ?')
+            params.append(status)
+        if prompt_like is not None:
+            clauses.append('prompt LIKE ?')
+            params.append(prompt_like)
+
+        for name, value in filters.items():
+            if name not in self.META_COLUMNS:
+                raise ValueError(f"Unknown catalog field: {name}")
+            if isinstance(value, (list, tuple, set)):
+                clauses.append(f'"{name}" IN ({", ".join("?" * len(value))})')
+                params.extend(value)
+            else:
+                clauses.append(f'"{name}" = ?')
+                params.append(value)
+
+        if order_by not in ('date_time', 'id', *self.META_COLUMNS):
+            raise ValueError(f"Unknown catalog field: {order_by}")
+
+        sql = 'SELECT * FROM renders'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += f' ORDER BY "{order_by}", id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+
+        with self.lock:
+            records = [self._record(row) for row in self.conn.execute(sql, params).fetchall()]
+        yield from records
+
+    def index_tree(self, output_dir):
+        """Backfill the catalog from an existing output folder. Returns the number of results indexed."""
+        output_dir = Path(output_dir)
+        count = 0
+
+        for json_path in output_dir.glob('*/json/*.json'):
+            try:
+                response = json.loads(json_path.read_text())
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(response, dict) or response.get('id') is None:
+                continue
+
+            id_dir = json_path.parent.parent
+            paths = [id_dir / os.path.basename(url) for url in response.get('output', [])]
+            self.index(response, [str(p) if p.exists() else None for p in paths])
+            count += 1
+
+        for record in json_utils.iter_records(output_dir / 'master.json'):
+            if self.get(record.get('id')) is None:
+                self.index(record)
+                count += 1
+
+        return count
+
+    def _record(self, row):
+        record = json.loads(row['response'])
+        files = self.conn.execute('SELECT url, path FROM files WHERE id = ?', (row['id'],)).fetchall()
+        if files:
+            paths = dict(files)
+            record['local_paths'] = [paths.get(url) for url in record.get('output', [])]
+        return record
@@ -0,0 +1,43 @@
+from pathlib import Path
+from PIL import Image
+from psd_tools import PSDImage
+from src.utils.file_cache import atomic_write, evict_lru, mark_used
+from src.utils.sys_utils import file_hash
+
+
+class CompositeCache:
+    """
+    Persistent cache of flattened PSD composites, keyed by the content hash of the PSD.
+
+    Compositing layers is far slower than decoding a PNG, so each PSD is composited once and
+    later conversions (other formats, sizes, color spaces or re-runs) read the cached PNG.
+    The least recently used composites are evicted once the cache grows past max_bytes.
+    Writes are atomic, so worker processes can share one cache folder.
+
+    Attributes:
+    cache_dir (str): Folder the flattened composites are stored in.
+    max_bytes (int): Size the cache is trimmed back to after a new composite is stored.
+    """
+
+    def __init__(self, cache_dir='./output/cache/psd', max_bytes=2 * 1024 ** 3):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def composite(self, psd_path, sha256=None):
+        cache_path = self.cache_dir / f'{sha256 or file_hash(psd_path)}.png'
+
+        if cache_path.exists():
+            mark_used(cache_path)
+            img = Image.open(cache_path)
+            img.load()
+            return img
+
+        img = PSDImage.open(psd_path).composite()
+
+        atomic_write(cache_path, lambda tmp_path: img.save(tmp_path, format='PNG', compress_level=1))
+        self.evict()
+        return img
+
+    def evict(self):
+        return evict_lru(self.cache_dir.glob('*.png'), self.max_bytes)
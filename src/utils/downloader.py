@@ -0,0 +1,76 @@
+# downloader.py
+
+import os
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils import http_client
+
+CHUNK_SIZE = 1 << 16
+
+
+def download_file(url, path, max_attempts=3):
+    """
+    Download url to path through a .part file that is renamed into place once complete.
+
+    A file at path is therefore always a finished download and is skipped. An interrupted
+    transfer leaves its .part file behind and the next attempt resumes it with a Range request.
+    """
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    part_path = f'{path}.part'
+
+    for attempt in range(max_attempts):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        try:
+            with http_client.get(url, headers=headers, stream=True) as response:
+                if response.status_code == 416:
+                    # the partial file no longer matches what the server has; start over
+                    os.remove(part_path)
+                    continue
+
+                if response.status_code not in (200, 206):
+                    print(f"Error downloading {url}: {response.status_code} - {response.text}")
+                    return None
+
+                if response.status_code == 200:
+                    offset = 0  # server ignored the Range header and sent the whole file
+
+                expected = _expected_size(response, offset)
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+        except requests.RequestException as e:
+            print(f"Download of {url} interrupted ({e}), resuming")
+            continue
+
+        if expected is None or os.path.getsize(part_path) == expected:
+            os.replace(part_path, path)
+            return path
+
+        print(f"Download of {url} incomplete ({os.path.getsize(part_path)} of {expected} bytes), resuming")
+
+    print(f"Failed to download {url} after {max_attempts} attempts")
+    return None
+
+
+def download_all(items, max_workers=8):
+    """Download (url, path) pairs concurrently. Returns the saved paths in order, None for failures."""
+    items = list(items)
+    if not items:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(lambda item: download_file(*item), items))
+
+
+def _expected_size(response, offset):
+    # iter_content decodes compressed bodies, so Content-Length only matches for identity encoding
+    length = response.headers.get('Content-Length')
+    if length is None or response.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    return offset + int(length)
@@ -0,0 +1,185 @@
+# fetch_scheduler.py
+
+import os
+import time
+import heapq
+import itertools
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils import json_utils, request_cache
+from src.utils.catalog import OutputCatalog
+from src.utils.image_utils import send_request, download_images, get_meta_data
+
+
+class FetchScheduler:
+    """
+    Polls queued Stable jobs from processing.json when they are due instead of on a fixed timer.
+
+    Jobs sit in a priority queue ordered by when they should next be polled: their 'available'
+    time at first, then an exponential backoff (or the API's new eta) after each poll that is
+    still processing. Due jobs are polled concurrently and finished jobs are dropped from
+    processing.json as soon as each batch completes. Jobs that come back as 'error' or 'failed'
+    are dropped at once, since polling them again cannot change the outcome. Jobs queued while
+    the scheduler runs are picked up after each batch.
+
+    Attributes:
+    processing_json_path (str): Run log of queued jobs written by ResponseProcessor.
+    json_output_path (str): Run log that fetched results are appended to.
+    api_key (str): Stable API key.
+    output_dir (str): Folder the fetched images are saved under, one subfolder per id.
+    max_workers (int): Number of polls in flight at once.
+    min_interval (float): Backoff after the first poll that is still processing, in seconds.
+    max_interval (float): Upper bound for the backoff, in seconds.
+    max_attempts (int): Polls after which a job that keeps failing is given up on.
+    """
+
+    def __init__(self, processing_json_path, json_output_path, api_key, output_dir='./output/images',
+                 max_workers=4, min_interval=5, max_interval=300, max_attempts=20):
+        self.processing_json_path = processing_json_path
+        self.json_output_path = json_output_path
+        self.api_key = api_key
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_attempts = max_attempts
+        self.queue = []
+        self.known = set()
+        self.counter = itertools.count()  # tie-breaker so dicts are never compared
+        # ResponseProcessor keeps the catalog next to processing.json
+        self.catalog = OutputCatalog.open(os.path.join(Path(processing_json_path).parent, 'catalog.db'))
+
+    def load(self):
+        self.queue = []
+        self.known = set()
+        self._load_new()
+
+    def _load_new(self):
+        for item in json_utils.iter_records(self.processing_json_path):
+            if str(item.get('id')) not in self.known:
+                self.known.add(str(item.get('id')))
+                self.schedule(item, self._available_at(item), attempt=0)
+
+    def schedule(self, item, due, attempt):
+        heapq.heappush(self.queue, (due, next(self.counter), attempt, item))
+
+    def run(self, wait=False, timeout=None):
+        """Poll due jobs. With wait=True keep going until the queue is empty or timeout passes."""
+        self.load()
+        deadline = time.time() + timeout if timeout else None
+        fetched = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while self.queue:
+                due = self._pop_due(time.time())
+
+                if due:
+                    batch_fetched, done, dropped = self._poll_batch(executor, due)
+                    fetched += batch_fetched
+                    self._persist(done, dropped)
+                    if not wait:
+                        break
+                    continue
+
+                if not wait:
+                    break
+
+                next_due = self.queue[0][0]
+                if deadline and next_due > deadline:
+                    break
+                time.sleep(max(0, next_due - time.time()))
+
+        if not self.queue and Path(self.processing_json_path).exists():
+            print('All images processed')
+        return fetched
+
+    def _pop_due(self, now):
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            due_at, _, attempt, item = heapq.heappop(self.queue)
+            due.append((attempt, item))
+        return due
+
+    def _poll_batch(self, executor, due):
+        """Poll a batch of due jobs. Returns the number fetched, the finished ids and the ids given up on."""
+        fetched = 0
+        done, dropped = [], []
+        for (attempt, item), (response, paths, error) in zip(due, executor.map(self._fetch, [item for _, item in due])):
+            status = response.get('status') if response else None
+
+            if status == 'success' and not error:
+                response['date_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                json_utils.append_to_jsonl(response, self.json_output_path)
+                self.catalog.index(response, paths)
+                request_cache.complete(item, response, paths)
+                done.append(item.get('id'))
+                fetched += 1
+                continue
+
+            if status in ('error', 'failed') and not error:
+                print(f"Image {item.get('id')} {status}: {response.get('message', '')}")
+                self.catalog.index(response)
+                done.append(item.get('id'))
+                continue
+
+            if error:
+                print(f"Error fetching {item.get('id')}: {error}")
+            elif status == 'processing':
+                print(f"Image {item.get('id')} not ready, polling again in {self._backoff(attempt, response):.0f} sec")
+
+            if attempt + 1 >= self.max_attempts:
+                print(f"Giving up on {item.get('id')} after {attempt + 1} polls")
+                dropped.append(item.get('id'))
+                continue
+            self.schedule(item, time.time() + self._backoff(attempt, response), attempt + 1)
+        return fetched, done, dropped
+
+    def _fetch(self, item):
+        paths = None
+        try:
+            response = send_request(item['id'], self.api_key)
+            if response is None:
+                return None, paths, 'request failed'
+            if response.get('status') == 'success' and response.get('output'):
+                paths = download_images(response['output'], os.path.join(self.output_dir, str(item['id'])))
+                if None in paths:
+                    return response, paths, f"{paths.count(None)} of {len(paths)} images failed to download"
+                response['meta'] = get_meta_data(item['id'], Path(self.processing_json_path).parent)
+            return response, paths, None
+        except Exception as e:
+            return None, paths, e
+
+    def _backoff(self, attempt, response=None):
+        delay = min(self.min_interval * 2 ** attempt, self.max_interval)
+        try:
+            eta = float((response or {}).get('eta') or 0)
+        except (TypeError, ValueError):
+            eta = 0
+        return max(delay, min(eta, self.max_interval))
+
+    def _persist(self, done, dropped):
+        # Remove only these ids, so records appended during the batch are kept. Finished jobs are
+        # tombstoned so a late 'processing' record cannot queue them again
+        if done:
+            json_utils.remove_records(self.processing_json_path, done, tombstone=True)
+        if dropped:
+            json_utils.remove_records(self.processing_json_path, dropped)
+        self._load_new()
+
+    @staticmethod
+    def _available_at(item):
+        if item.get('available_at'):
+            return float(item['available_at'])
+
+        # Older records only carry the wall-clock time the job should be ready at
+        try:
+            available = datetime.strptime(item['available'], "%H:%M:%S").time()
+            return datetime.combine(datetime.now().date(), available).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return time.time()
+
+
+def fetch_images(file_path, json_output_path, api_key, wait=False, timeout=None, max_workers=4):
+    return FetchScheduler(file_path, json_output_path, api_key, max_workers=max_workers).run(wait, timeout)
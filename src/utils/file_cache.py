@@ -0,0 +1,67 @@
+# file_cache.py
+
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+
+class SharedByPath:
+    """
+    Mixin for stores backed by one file, such as SQLite databases, that should be opened once
+    per process. open() returns the instance already made for a path, keyed by class and
+    absolute path, and creates it on first use.
+    """
+
+    _open_instances = {}
+    _open_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        key = (cls, os.path.abspath(path))
+        with SharedByPath._open_lock:
+            if key not in SharedByPath._open_instances:
+                SharedByPath._open_instances[key] = cls(path)
+            return SharedByPath._open_instances[key]
+
+
+def atomic_write(path, write):
+    """
+    Call write(tmp_path) on a uniquely named file next to path, then move it into place.
+
+    Readers, other threads and worker processes see either the old file or the complete new one.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'{path.name}.', suffix='.tmp', dir=path.parent)
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def mark_used(path):
+    # A cache entry's mtime doubles as its last-used time, which evict_lru orders by
+    os.utime(path)
+
+
+def evict_lru(paths, max_bytes):
+    """Delete the least recently used of paths until their total size is at most max_bytes. Returns that total."""
+    entries = []
+    for path in paths:
+        try:
+            stat = Path(path).stat()
+        except FileNotFoundError:
+            continue  # removed by another process since it was listed
+        entries.append((stat.st_mtime, stat.st_size, Path(path)))
+
+    entries.sort(key=lambda entry: entry[0])
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+    return total
@@ -0,0 +1,95 @@
+# http_client.py
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.utils import rate_limiter
+
+DEFAULT_TIMEOUT = (10, 120)  # (connect, read) seconds
+POOL_CONNECTIONS = 4         # number of hosts to keep a pool for
+POOL_MAXSIZE = 16            # keep-alive connections kept per host
+MAX_RETRIES = 2
+RATE_LIMIT_RETRIES = 5       # resends after a rate-limited response, for hosts with a limiter
+
+_session = None
+_lock = threading.Lock()
+
+
+def configure(timeout=None, pool_connections=None, pool_maxsize=None, max_retries=None):
+    """Change the shared client settings. The session is rebuilt on next use."""
+    global DEFAULT_TIMEOUT, POOL_CONNECTIONS, POOL_MAXSIZE, MAX_RETRIES, _session
+
+    with _lock:
+        if timeout is not None:
+            DEFAULT_TIMEOUT = timeout
+        if pool_connections is not None:
+            POOL_CONNECTIONS = pool_connections
+        if pool_maxsize is not None:
+            POOL_MAXSIZE = pool_maxsize
+        if max_retries is not None:
+            MAX_RETRIES = max_retries
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session():
+    global _session
+
+    with _lock:
+        if _session is None:
+            _session = _build_session()
+        return _session
+
+
+def _build_session():
+    # Only retry connection-level failures; POSTs to the render API are not idempotent
+    retry = Retry(total=MAX_RETRIES, connect=MAX_RETRIES, read=0, status=0, backoff_factor=0.5)
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=True,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    limiter = rate_limiter.for_url(url)
+    if limiter is None:
+        return get_session().request(method, url, **kwargs)
+
+    inspect_body = not kwargs.get('stream')
+    for _ in range(RATE_LIMIT_RETRIES):
+        limiter.acquire()
+        response = get_session().request(method, url, **kwargs)
+        is_json = 'json' in response.headers.get('Content-Type', '')
+        if not rate_limiter.is_rate_limited(response, inspect_body and is_json):
+            limiter.speed_up()
+            return response
+        print(f"Rate limited by {url}, slowing down")
+        limiter.slow_down(rate_limiter.retry_after(response))
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def close():
+    global _session
+
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -1,14 +1,22 @@
 import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 from pathlib import Path
 from psd_tools import PSDImage
-from src.utils.sys_utils import create_dirs
+from src.utils.composite_cache import CompositeCache
+from src.utils.file_cache import atomic_write
+from src.utils.sys_utils import create_dirs, file_hash
 
 
 class ImageConverter:
     """
     Class to convert images to a specified format, size, and color space.
 
+    Several variants can be produced in one pass by giving a list of outputs. Each source is
+    then read and decoded (or composited) once and every variant is derived from that image.
+
     Attributes:
     source (str): Path of the source image or directory containing images.
     output_folder (str, optional): Folder where the converted images will be saved. If not provided, images are saved in a subdirectory of the source directory named after the target format.
@@ -16,15 +24,37 @@ class ImageConverter:
     size (tuple, optional): Target image size as a tuple (width, height). Default is None.
     color_space (str, optional): Target color space. Can be 'RGB' or 'CMYK'. Default is None.
     recursive (bool, optional): Flag to indicate whether to recursively convert images in subdirectories. Default is False.
+    workers (int, optional): Number of worker processes used to convert a folder. Default is None, which converts in this process.
+    incremental (bool, optional): Only convert images that are new or changed since the last run, tracked in a manifest in the output folder. Default is False.
+    remove_orphans (bool, optional): In incremental mode, delete outputs whose source image no longer exists. Default is False.
+    fast_resize (bool, optional): Downscale at decode time (JPEG draft mode) and reduce by whole factors before the final resample. Default is False.
+    keep_aspect (bool, optional): Fit the image inside size, keeping its aspect ratio and never enlarging it, instead of stretching it to size. Default is False.
+    resample (str, optional): Resampling filter name, e.g. 'lanczos', 'bicubic' or 'nearest'. Default is None, which uses Pillow's default.
+    psd_cache_dir (str, optional): Folder of a CompositeCache that flattened PSD composites are read from and stored in. Default is None, which composites every time.
+    outputs (list, optional): Output specs as dicts with 'target_format' and optionally 'size', 'color_space' and 'output_folder'. Default is None, which produces the single output described by the arguments above.
     """
 
-    def __init__(self, source, target_format='JPEG', size=None, color_space=None, recursive=False, output_folder=None):
+    MANIFEST_NAME = '.convert_manifest.json'
+
+    IMAGE_EXTENSIONS = ('.psd', '.jpeg', '.jpg', '.png', '.bmp', '.gif', '.tiff')
+
+    def __init__(self, source, target_format='JPEG', size=None, color_space=None, recursive=False, output_folder=None, workers=None,
+                 incremental=False, remove_orphans=False, fast_resize=False, keep_aspect=False, resample=None,
+                 psd_cache_dir=None, outputs=None):
         self.source = source
         self.output_folder = output_folder
         self.target_format = target_format
         self.size = size
         self.color_space = color_space
         self.recursive = recursive
+        self.workers = workers
+        self.incremental = incremental
+        self.remove_orphans = remove_orphans
+        self.fast_resize = fast_resize
+        self.keep_aspect = keep_aspect
+        self.resample = resample
+        self.psd_cache_dir = psd_cache_dir
+        self.outputs = outputs
 
     def convert(self):
         """Start the image conversion process."""
@@ -32,60 +62,218 @@ class ImageConverter:
         if self.output_folder is None:
             self.output_folder = Path(self.source) / self.target_format.lower()
 
-        create_dirs([self.output_folder])
+        self.specs = self._output_specs()
+        create_dirs([spec['output_folder'] for spec in self.specs])
 
         if os.path.isdir(self.source):
-            self._convert_images_in_folder()
+            return self._convert_images_in_folder()
         else:
-            self._convert_single_image(self.source)
+            target_paths = self._convert_single_image(self.source)
+            return target_paths if self.outputs else target_paths[0]
 
-    def _convert_images_in_folder(self):
+    def _output_specs(self):
+        outputs = self.outputs or [{
+            'target_format': self.target_format,
+            'size': self.size,
+            'color_space': self.color_space,
+            'output_folder': self.output_folder
+        }]
+
+        specs = []
+        for output in outputs:
+            spec = {'target_format': 'JPEG', 'size': None, 'color_space': None, 'output_folder': None, **output}
+            if spec['output_folder'] is None:
+                spec['output_folder'] = Path(self.source) / spec['target_format'].lower()
+            specs.append(spec)
+        return specs
+
+    def _find_images(self):
         for foldername, _, filenames in os.walk(self.source):
             for filename in filenames:
-                if filename.lower().endswith(('.psd', '.jpeg', '.jpg', '.png', '.bmp', '.gif', '.tiff')):
-                    img_path = os.path.join(foldername, filename)
-                    self._convert_single_image(img_path)
+                if filename.lower().endswith(self.IMAGE_EXTENSIONS):
+                    yield os.path.join(foldername, filename)
             if not self.recursive:
                 break
 
+    def _convert_images_in_folder(self):
+        image_paths = list(self._find_images())
+        if self.incremental:
+            manifest = self._load_manifest()
+            if self.remove_orphans:
+                self._remove_orphans(manifest, image_paths)
+            skipped = len(image_paths)
+            image_paths = [image_path for image_path in image_paths if self._needs_conversion(image_path, manifest)]
+            skipped -= len(image_paths)
+            print(f"Skipping {skipped} unchanged images")
+
+        start = time.perf_counter()
+
+        if self.workers and self.workers > 1 and len(image_paths) > 1:
+            # Decoding and compositing are CPU-bound, so files are split across processes in chunks
+            chunksize = max(1, len(image_paths) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self._convert_file, image_paths, chunksize=chunksize))
+        else:
+            results = [self._convert_file(image_path) for image_path in image_paths]
+
+        elapsed = time.perf_counter() - start
+        errors = {image_path: error for image_path, _, error in results if error}
+        for image_path, error in errors.items():
+            print(f"Failed to convert {image_path}: {error}")
+
+        converted = len(results) - len(errors)
+        rate = converted / elapsed if elapsed else 0
+        print(f"Converted {converted} of {len(results)} images in {elapsed:.1f}s ({rate:.2f} images/s)")
+
+        if self.incremental:
+            for image_path, target_paths, error in results:
+                if not error:
+                    manifest[os.path.abspath(image_path)] = self._manifest_entry(image_path, target_paths)
+            self._save_manifest(manifest)
+        return results
+
+    def _manifest_path(self):
+        return os.path.join(self.specs[0]['output_folder'], self.MANIFEST_NAME)
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        atomic_write(self._manifest_path(), lambda tmp_path: Path(tmp_path).write_text(json.dumps(manifest, indent=4)))
+
+    @staticmethod
+    def _manifest_entry(image_path, target_paths, sha256=None):
+        stat = os.stat(image_path)
+        return {
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha256': sha256 or file_hash(image_path),
+            'targets': target_paths
+        }
+
+    def _needs_conversion(self, image_path, manifest):
+        target_paths = [self._target_path(image_path, spec) for spec in self.specs]
+        if not all(os.path.exists(target_path) for target_path in target_paths):
+            return True
+
+        key = os.path.abspath(image_path)
+        entry = manifest.get(key)
+        stat = os.stat(image_path)
+
+        if entry is None or entry.get('targets') != target_paths:
+            # No record yet, e.g. the first incremental run: trust outputs that are newer than their source
+            if min(os.path.getmtime(target_path) for target_path in target_paths) >= stat.st_mtime:
+                manifest[key] = self._manifest_entry(image_path, target_paths)
+                return False
+            return True
+
+        if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return False
+
+        # Touched but possibly unchanged (e.g. copied back from a backup); compare contents
+        sha256 = file_hash(image_path)
+        if sha256 == entry['sha256']:
+            manifest[key] = self._manifest_entry(image_path, target_paths, sha256)
+            return False
+        return True
+
+    def _remove_orphans(self, manifest, image_paths):
+        current = {os.path.abspath(image_path) for image_path in image_paths}
+        for source in [source for source in manifest if source not in current]:
+            entry = manifest.pop(source)
+            for target_path in entry.get('targets') or [entry['target']]:
+                if os.path.exists(target_path):
+                    os.remove(target_path)
+                    print(f"Removed orphaned output: {target_path}")
+
+    def _convert_file(self, image_path):
+        try:
+            return image_path, self._convert_single_image(image_path), None
+        except Exception as e:
+            return image_path, None, f"{type(e).__name__}: {e}"
+
     def _convert_single_image(self, image_path):
+        specs = self.specs
+        sizes = [spec['size'] for spec in specs]
+
         if image_path.lower().endswith('.psd'):
-            psd = PSDImage.open(image_path)
-            img = psd.composite()
+            img = self._composite_psd(image_path)
         else:
             img = Image.open(image_path)
+            if self.fast_resize and all(sizes):
+                # Let the JPEG decoder scale by 1/2, 1/4 or 1/8 while staying at least as large as every size
+                img.draft(None, (max(size[0] for size in sizes), max(size[1] for size in sizes)))
+
+        # RGBA images are left as they are, convert() would only make a copy. Others are expanded once,
+        # straight to RGB when that is the only target, rather than to RGBA and then again to RGB
+        if img.mode == 'LA' or (img.mode == 'P' and 'transparency' in img.info):
+            all_rgb = all(spec['color_space'] and spec['color_space'].upper() == 'RGB' for spec in specs)
+            img = img.convert('RGB' if all_rgb else 'RGBA')
+        img.load()
 
-        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-            img = img.convert('RGBA')
+        # Every variant is derived from the one decoded image
+        target_paths = []
+        for spec in specs:
+            variant = img
 
-        if self.size:
-            img = img.resize(self.size)
+            if spec['size']:
+                variant = self._resize(variant, spec['size'])
 
-        if self.color_space:
-            img = self._convert_color_space(img)
+            if spec['color_space']:
+                variant = self._convert_color_space(variant, spec['color_space'])
 
+            target_path = self._target_path(image_path, spec)
+
+            variant.save(target_path, format=spec['target_format'])
+            print(f"Converted image saved at: {target_path}")
+            target_paths.append(target_path)
+
+        return target_paths
+
+    def _composite_psd(self, image_path):
+        if self.psd_cache_dir:
+            return CompositeCache(self.psd_cache_dir).composite(image_path)
+        return PSDImage.open(image_path).composite()
+
+    def _resize(self, img, size):
+        resample = getattr(Image.Resampling, self.resample.upper()) if self.resample else None
+        # reducing_gap shrinks by whole factors with a cheap box filter before the final resample
+        reducing_gap = 3.0 if self.fast_resize else None
+
+        if self.keep_aspect:
+            # thumbnail() works in place and the decoded image is shared between variants
+            img = img.copy()
+            img.thumbnail(size, resample if resample is not None else Image.Resampling.BICUBIC, reducing_gap)
+            return img
+
+        if resample is None:
+            return img.resize(size, reducing_gap=reducing_gap)
+        return img.resize(size, resample, reducing_gap=reducing_gap)
+
+    def _target_path(self, image_path, spec):
         filename = os.path.basename(image_path)
         base_filename, _ = os.path.splitext(filename)
         
-        if self.size:
-            size_suffix = f"_{self.size[0]}x{self.size[1]}"
+        if spec['size']:
+            size_suffix = f"_{spec['size'][0]}x{spec['size'][1]}"
         else:
             size_suffix = ""
         
-        if self.color_space:
-            color_suffix = f"_{self.color_space}"
+        if spec['color_space']:
+            color_suffix = f"_{spec['color_space']}"
         else:
             color_suffix = ""
             
-        target_filename = f"{base_filename}{color_suffix}{size_suffix}.{self.target_format.lower()}"
-
-        target_path = os.path.join(self.output_folder, target_filename)
+        target_filename = f"{base_filename}{color_suffix}{size_suffix}.{spec['target_format'].lower()}"
 
-        img.save(target_path, format=self.target_format)
-        print(f"Converted image saved at: {target_path}")
+        return os.path.join(spec['output_folder'], target_filename)
 
-    def _convert_color_space(self, img):
-        target_color_space = self.color_space.upper()
+    def _convert_color_space(self, img, color_space):
+        target_color_space = color_space.upper()
 
         if target_color_space == 'CMYK' and img.mode != 'CMYK':
             return img.convert('CMYK')
@@ -1,21 +1,22 @@
 #src.utils.image_processor.py
 import os
 import shutil
-import time
 import logging
+import warnings
 
-from src.utils.image_utils import img_to_grid, web_grid, image_download, fetch_images
-from src.utils.sys_utils import stable_sync
+from src.utils.fetch_scheduler import fetch_images
+from src.utils.post_utils import img_to_grid, web_grid, stable_sync
 
 
 class ImageProcessor:
     def __init__(self, stable_api_key, processing_json_path='/content/unstable/output/images/processing.json',
                  backup_src='/content/unstable/output/images', backup_dest='/content/drive/MyDrive/unstable/images/output',
-                 debug=False):
+                 incremental_backup=True, debug=False):
         self.stable_api_key = stable_api_key
         self.processing_json_path = processing_json_path
         self.backup_src = backup_src
         self.backup_dest = backup_dest
+        self.incremental_backup = incremental_backup
         self.debug = debug
         self.logger = self._configure_logger()
 
@@ -28,13 +29,18 @@ class ImageProcessor:
         logger.addHandler(handler)
         return logger
 
-    def fetch_processed_image(self, json_output_path, pause=False, pause_sec=20, fetch=True):
-        if pause:
-            time.sleep(pause_sec)
+    def fetch_processed_image(self, json_output_path, pause=False, pause_sec=None, fetch=True,
+                              wait=False, timeout=None, max_workers=4):
+        # wait=True blocks until every queued job is fetched, sleeping only until the next one is due
+        if pause or pause_sec is not None:
+            warnings.warn('pause and pause_sec are deprecated, use wait and timeout', DeprecationWarning, stacklevel=2)
+            wait = wait or bool(pause)
+            timeout = timeout if timeout is not None else pause_sec
 
         if fetch:
             if os.path.isfile(self.processing_json_path):
-                fetch_images(self.processing_json_path, json_output_path, self.stable_api_key)
+                fetch_images(self.processing_json_path, json_output_path, self.stable_api_key,
+                             wait=wait, timeout=timeout, max_workers=max_workers)
             else:
                 self.logger.info('All images processed')
 
@@ -47,7 +53,7 @@ class ImageProcessor:
 
     def backup_image(self, image_backup=False):
         try:
-            stable_sync(self.backup_src, self.backup_dest)
+            stable_sync(self.backup_src, self.backup_dest, incremental=self.incremental_backup)
             if self.debug:
               self.logger.info('Synced %s %s', self.backup_src, self.backup_dest)
         except Exception as e:
@@ -1,45 +1,103 @@
 import os
 import json
+import sqlite3
+import threading
 from pyuploadcare import Uploadcare
 from pathlib import Path
+from src.utils.file_cache import SharedByPath
+from src.utils.sys_utils import file_hash
+
+
+class UploadLedger(SharedByPath):
+    """
+    SQLite-backed record of uploaded images, keyed by content hash.
+
+    The tables are read into memory once per process and every new upload is written
+    in its own transaction, so the ledger is never rewritten as a whole.
+
+    Attributes:
+    db_path (str): Path of the SQLite database file.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS uploads (sha256 TEXT PRIMARY KEY, url TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS paths (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT)')
+
+        self.urls = dict(self.conn.execute('SELECT sha256, url FROM uploads'))
+        self.paths = {path: (size, mtime, sha256) for path, size, mtime, sha256 in self.conn.execute('SELECT * FROM paths')}
+
+    def lookup_path(self, path, size, mtime):
+        with self.lock:
+            entry = self.paths.get(path)
+            if entry and entry[0] == size and entry[1] == mtime:
+                return self.urls.get(entry[2])
+        return None
+
+    def lookup_hash(self, sha256):
+        with self.lock:
+            return self.urls.get(sha256)
+
+    def record(self, path, size, mtime, sha256, url):
+        with self.lock:
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO uploads VALUES (?, ?)', (sha256, url))
+                self.conn.execute('INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)', (path, size, mtime, sha256))
+            self.urls[sha256] = url
+            self.paths[path] = (size, mtime, sha256)
+
 
 class ImageUploader:
     """
     Class to upload images and keep track of uploaded images.
 
+    Uploads are cached by file content, so a renamed or moved image is not sent again and an
+    edited image at the same path is. Size and mtime are checked first to avoid re-hashing
+    files that have not changed since they were last seen.
+
     Attributes:
-    uploaded_json_path (str): Path of the JSON file that tracks uploaded images.
+    ledger_path (str): Path of the SQLite ledger that tracks uploaded images.
+    legacy_json_path (str): Path of the old path-keyed uploaded.json, used as a fallback for images uploaded before the ledger existed.
     """
-    
-    def __init__(self, uploaded_json_path='/content/drive/MyDrive/unstable/images/uploaded/uploaded.json'):
+
+    def __init__(self, ledger_path='/content/drive/MyDrive/unstable/images/uploaded/uploaded.db',
+                 legacy_json_path='/content/drive/MyDrive/unstable/images/uploaded/uploaded.json'):
         public_key = os.environ.get('UCARE_API_KEY_PUBLIC')
         secret_key = os.environ.get('UCARE_API_KEY_SECRET')
         self.uploadcare = Uploadcare(public_key, secret_key)
-        self.uploaded_json_path = uploaded_json_path
-        Path(self.uploaded_json_path).parent.mkdir(parents=True, exist_ok=True)
-        if not Path(self.uploaded_json_path).exists():
-            with open(self.uploaded_json_path, 'w') as f:
-                json.dump({}, f)
+        self.ledger = UploadLedger.open(ledger_path)
+        self.legacy_uploads, self.legacy_mtime = self._load_legacy(legacy_json_path)
 
-    def upload_img(self, img_path):
+    @staticmethod
+    def _load_legacy(legacy_json_path):
         try:
-            with open(self.uploaded_json_path, 'r') as f:
-                uploaded_files = json.load(f)
-        except json.JSONDecodeError:
-            with open(self.uploaded_json_path, 'w') as f:
-                json.dump({}, f)
-            uploaded_files = {}
-
-        if img_path in uploaded_files:
-            # print(f"Image at path {img_path} has already been uploaded.")
-            return uploaded_files[img_path]
-        
-        with open(img_path, 'rb') as file_object:
-            ucare_file = self.uploadcare.upload(file_object)
-
-        uploaded_files[img_path] = str(ucare_file)
-
-        with open(self.uploaded_json_path, 'w') as f:
-            json.dump(uploaded_files, f)
-
-        return str(ucare_file)
+            with open(legacy_json_path, 'r') as f:
+                return json.load(f), os.path.getmtime(legacy_json_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}, 0
+
+    def upload_img(self, img_path):
+        path = os.path.abspath(img_path)
+        stat = os.stat(path)
+
+        url = self.ledger.lookup_path(path, stat.st_size, stat.st_mtime)
+        if url:
+            return url
+
+        sha256 = file_hash(path)
+        url = self.ledger.lookup_hash(sha256)
+        if url is None and stat.st_mtime <= self.legacy_mtime:
+            # only trust a path-keyed legacy entry if the file has not been edited since it was written
+            url = self.legacy_uploads.get(img_path)
+
+        if url is None:
+            with open(path, 'rb') as file_object:
+                url = str(self.uploadcare.upload(file_object))
+
+        self.ledger.record(path, stat.st_size, stat.st_mtime, sha256, url)
+        return url
@@ -1,80 +1,47 @@
 # image_utils.py
 
 import os
-import requests
-import shutil
 import json
-from pathlib import Path
-from PIL import Image
-from io import BytesIO
-
-import matplotlib.pyplot as plt
+import requests
 
 from src.utils import (
-    json_utils,
-    sys_utils
+    downloader,
+    http_client
 )
-
-
-def fetch_images(file_path, json_output_path, api_key):
-    data = json.loads(Path(file_path).read_text())
-
-    updated_data = []
-    fetched_data = []  
-
-    for item in data:
-        response = send_request(item['id'], api_key)
-        
-        if response['status'] == 'success' and response['output']:
-            try:
-                download_images(response['output'], f'./output/images/{item["id"]}')
-                response['meta'] = get_meta_data(item['id'], Path(file_path).parent)
-                fetched_data.append(response)
-            except Exception as e:
-                print(f"Error downloading images: {e}")
-            finally:
-                updated_data.append(item)
-
-        elif response['status'] == 'processing':
-            print(f"Image not ready. Try again at {item.get('available')}")
-            updated_data.append(item)
-        else:
-            updated_data.append(item)
-
-    Path(file_path).write_text(json.dumps(updated_data, indent=4))
-
-    for fetched_item in fetched_data:
-        json_utils.append_to_json(fetched_item, json_output_path)
+from src.utils.catalog import OutputCatalog
 
 
 def send_request(id, api_key):
     url = f"https://stablediffusionapi.com/api/v3/fetch/{id}" 
     headers = {'Content-Type': 'application/json'}
     data = {"key": api_key}
-    return requests.post(url, headers=headers, json=data).json()
-
-
-def download_images(image_urls, output_path):
-    for url in image_urls:
-        filename = os.path.basename(url)
-        image_download(url, f'{output_path}/{filename}')
-        print(f"Downloaded {url}")
+    try:
+        return http_client.post(url, headers=headers, json=data).json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Fetching {id} failed: {e}")
+        return None
+
+
+def download_images(image_urls, output_path, max_workers=8):
+    paths = downloader.download_all(
+        [(url, f'{output_path}/{os.path.basename(url)}') for url in image_urls],
+        max_workers=max_workers
+    )
+    for url, path in zip(image_urls, paths):
+        if path:
+            print(f"Downloaded {url}")
+    return paths
         
 
 def image_download(url, path):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    response = requests.get(url, stream=True)
-
-    if response.status_code == 200:
-        with open(path, 'wb') as f:
-            response.raw.decode_content = True
-            shutil.copyfileobj(response.raw, f)
-        return path
-    
-    print(f"Error downloading {url}: {response.status_code} - {response.text}")
+    return downloader.download_file(url, path)
 
 
 def get_meta_data(id, base_path):
+    meta = OutputCatalog.open(base_path / 'catalog.db').get_meta(id)
+    if meta:
+        return meta
+
     json_path = base_path / f"{id}/json/{id}.json"
     data = json.loads(json_path.read_text())
     return data.get('meta', {})
@@ -1,6 +1,24 @@
+import os
 import json
+import hashlib
+import tempfile
+import threading
 from pathlib import Path
 
+_append_lock = threading.RLock()
+# Keys removed from a run log as completed, per path, so a late record for them is not appended again
+_tombstones = {}
+# Keys waiting for queue_removal's next rewrite, per path and index key
+_pending_removals = {}
+_pending_lock = threading.Lock()
+
+
+def canonical_hash(data, exclude=()):
+    """Stable SHA-256 of a JSON-like dict, ignoring key order and the keys in exclude."""
+    data = {k: v for k, v in data.items() if k not in exclude}
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
 def write_to_json(data, path):
     Path(path).write_text(
         json.dumps(data, indent=4, separators=(',', ': '))
@@ -15,3 +33,174 @@ def append_to_json(data, path):
     existing.append(data)
     
     write_to_json(existing, path)
+
+
+# JSON Lines run logs (master.json / processing.json): one record per line, appended in place
+
+def index_path(path):
+    return f'{path}.idx'
+
+def append_to_jsonl(data, path, index_key='id'):
+    line = (json.dumps(data, separators=(',', ':')) + '\n').encode('utf-8')
+    key = data.get(index_key) if index_key and isinstance(data, dict) else None
+
+    with _append_lock:
+        if key is not None and str(key) in _tombstones.get(os.path.abspath(path), ()):
+            return False
+        _migrate_json_array(path)
+        with open(path, 'ab+') as f:
+            offset = f.seek(0, os.SEEK_END)
+            if offset and _last_byte(f) != b'\n':
+                # terminate a torn line left by a crash so this record starts cleanly
+                f.write(b'\n')
+                offset += 1
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if key is not None:
+            with open(index_path(path), 'a') as f:
+                f.write(f'{key}\t{offset}\n')
+    return True
+
+def iter_records(path):
+    path = Path(path)
+    if not path.exists():
+        return
+
+    if _is_json_array(path):
+        yield from json.loads(path.read_text())
+        return
+
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # a torn final line from an interrupted write; everything before it is intact
+                continue
+
+def read_records(path):
+    return list(iter_records(path))
+
+def rewrite_records(records, path, index_key='id'):
+    """Atomically replace a run log with the given records and rebuild its index."""
+    idx_lines = []
+
+    # Held from write to replace, so no append can land in the file being replaced
+    with _append_lock:
+        fd, tmp_path = tempfile.mkstemp(prefix=f'{Path(path).name}.', suffix='.tmp', dir=Path(path).parent)
+        with os.fdopen(fd, 'wb') as f:
+            for record in records:
+                offset = f.tell()
+                f.write((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+                if index_key and isinstance(record, dict) and record.get(index_key) is not None:
+                    idx_lines.append(f'{record[index_key]}\t{offset}\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+        if index_key:
+            Path(index_path(path)).write_text(''.join(idx_lines))
+
+def update_records(path, fn, index_key='id'):
+    """Rewrite a run log with fn(records), holding the append lock so no concurrent append is lost."""
+    with _append_lock:
+        records = read_records(path)
+        updated = fn(records)
+        if updated != records:
+            rewrite_records(updated, path, index_key)
+        return updated
+
+def remove_record(path, key, index_key='id', tombstone=False):
+    """Remove the records for key. With tombstone, later appends for key to this path are dropped too."""
+    remove_records(path, [key], index_key, tombstone)
+
+def remove_records(path, keys, index_key='id', tombstone=False):
+    keys = {str(key) for key in keys}
+    with _append_lock:
+        if tombstone:
+            add_tombstones(path, keys)
+        update_records(path, lambda records: [r for r in records if str(r.get(index_key)) not in keys], index_key)
+
+def add_tombstones(path, keys):
+    """Drop later appends for keys to path, without rewriting the records already there."""
+    with _append_lock:
+        _tombstones.setdefault(os.path.abspath(path), set()).update(str(key) for key in keys)
+
+def queue_removal(path, keys, index_key='id'):
+    """
+    remove_records for callers that finish one key at a time, such as webhook callbacks. Keys
+    queued by other threads while a rewrite is running are removed together by the next one.
+    """
+    pending_key = (os.path.abspath(path), index_key)
+    with _pending_lock:
+        _pending_removals.setdefault(pending_key, set()).update(str(key) for key in keys)
+
+    with _append_lock:
+        with _pending_lock:
+            keys = _pending_removals.pop(pending_key, set())
+        if keys:
+            remove_records(path, keys, index_key)
+
+def build_index(path, index_key='id'):
+    idx_lines = []
+    with open(path, 'rb') as f:
+        offset = f.tell()
+        for line in iter(f.readline, b''):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            if isinstance(record, dict) and record.get(index_key) is not None:
+                idx_lines.append(f'{record[index_key]}\t{offset}\n')
+            offset = f.tell()
+
+    Path(index_path(path)).write_text(''.join(idx_lines))
+
+def load_index(path):
+    offsets = {}
+    idx = Path(index_path(path))
+    if not idx.exists():
+        return offsets
+
+    for line in idx.read_text().splitlines():
+        key, _, offset = line.rpartition('\t')
+        if key:
+            offsets[key] = int(offset)  # later appends for the same id win
+    return offsets
+
+def lookup_record(path, key, index_key='id'):
+    if not Path(path).exists():
+        return None
+
+    _migrate_json_array(path)
+    if not Path(index_path(path)).exists():
+        build_index(path, index_key)
+
+    offset = load_index(path).get(str(key))
+    if offset is None:
+        return None
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        try:
+            return json.loads(f.readline())
+        except json.JSONDecodeError:
+            return None
+
+def _last_byte(f):
+    f.seek(-1, os.SEEK_END)
+    return f.read(1)
+
+def _is_json_array(path):
+    with open(path, 'rb') as f:
+        head = f.read(64).lstrip()
+    return head.startswith(b'[')
+
+def _migrate_json_array(path):
+    # Older runs wrote these logs as one indented JSON array; convert them once in place
+    if Path(path).exists() and _is_json_array(path):
+        rewrite_records(json.loads(Path(path).read_text()), path)
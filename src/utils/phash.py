@@ -0,0 +1,164 @@
+# phash.py
+
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from src.utils.file_cache import atomic_write
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Set bits per byte, for Hamming distances on numpy versions without np.bitwise_count
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def dhash(path, hash_size=8):
+    """64-bit difference hash: whether each pixel of a tiny grayscale copy is brighter than its right neighbour."""
+    with Image.open(path) as img:
+        img.draft('L', (hash_size * 8, hash_size * 8))  # JPEGs decode straight at a reduced scale
+        pixels = np.asarray(
+            img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS, reducing_gap=2.0),
+            dtype=np.int16
+        )
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(hash, hashes):
+    """Hamming distance from one hash to every hash in a uint64 array."""
+    diff = np.bitwise_xor(hashes, np.uint64(hash))
+    return _POPCOUNT[diff.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PerceptualIndex:
+    """
+    Perceptual hashes of images, for finding near-duplicates such as renders of neighbouring
+    guidance_scale values with a fixed seed.
+
+    Hashes are kept in a growing numpy array so each lookup compares against every indexed image
+    at once. With cache_path, hashes are stored by path, size and mtime and only new or changed
+    images are decoded again.
+
+    Attributes:
+    threshold (int): Maximum Hamming distance (out of 64 bits) for two images to count as duplicates.
+    cache_path (str, optional): JSON file the hashes are cached in.
+    """
+
+    def __init__(self, threshold=6, cache_path=None, workers=8):
+        self.threshold = threshold
+        self.cache_path = cache_path
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.paths = []
+        self.hashes = np.zeros(64, dtype=np.uint64)
+        self.cache = {}
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                self.cache = json.loads(Path(cache_path).read_text())
+            except json.JSONDecodeError:
+                self.cache = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def hash(self, path):
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        cached = self.cache.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return int(cached[2], 16)
+
+        value = dhash(path)
+        with self.lock:
+            self.cache[key] = [stat.st_size, stat.st_mtime, f'{value:016x}']
+        return value
+
+    def nearest(self, hash):
+        """Indexed path closest to hash if it is within threshold, else None."""
+        with self.lock:
+            if not self.paths:
+                return None
+            distances = hamming(hash, self.hashes[:len(self.paths)])
+            i = int(distances.argmin())
+            return self.paths[i] if distances[i] <= self.threshold else None
+
+    def add(self, path, hash=None):
+        hash = self.hash(path) if hash is None else hash
+        with self.lock:
+            if len(self.paths) == len(self.hashes):
+                self.hashes = np.concatenate([self.hashes, np.zeros(len(self.hashes), dtype=np.uint64)])
+            self.hashes[len(self.paths)] = hash
+            self.paths.append(path)
+        return hash
+
+    def add_unique(self, path):
+        """Index path unless it duplicates an indexed image. Returns that image's path, or None if path was added."""
+        hash = self.hash(path)
+        duplicate = self.nearest(hash)
+        if duplicate is None:
+            self.add(path, hash)
+        return duplicate
+
+    def add_all(self, paths):
+        paths = list(paths)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            hashes = list(executor.map(self.hash, paths))
+        for path, hash in zip(paths, hashes):
+            self.add(path, hash)
+        self.save()
+
+    def clusters(self):
+        """Groups of near-duplicate paths (single-linkage), largest first. Images without duplicates are left out."""
+        with self.lock:
+            hashes = self.hashes[:len(self.paths)]
+            paths = list(self.paths)
+
+        parent = list(range(len(paths)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i in range(len(paths) - 1):
+            for j in np.nonzero(hamming(hashes[i], hashes[i + 1:]) <= self.threshold)[0]:
+                root_i, root_j = find(i), find(i + 1 + int(j))
+                if root_i != root_j:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+
+        groups = {}
+        for i, path in enumerate(paths):
+            groups.setdefault(find(i), []).append(path)
+        return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with self.lock:
+            data = json.dumps(self.cache)
+        atomic_write(self.cache_path, lambda tmp_path: Path(tmp_path).write_text(data))
+
+
+def find_images(folder, recursive=True):
+    pattern = '**/*' if recursive else '*'
+    return sorted(str(p) for p in Path(folder).glob(pattern) if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def find_duplicates(folder='./output/images', threshold=6, recursive=True, workers=8):
+    """Index every image under folder and print the clusters of near-duplicates. Returns the clusters."""
+    index = PerceptualIndex(threshold, os.path.join(folder, '.phash_cache.json'), workers)
+    index.add_all(find_images(folder, recursive))
+    clusters = index.clusters()
+
+    redundant = sum(len(c) - 1 for c in clusters)
+    print(f"{len(index)} images, {len(clusters)} clusters of near-duplicates, {redundant} redundant")
+    for cluster in clusters:
+        print(f"  {cluster[0]} ~ {', '.join(cluster[1:])}")
+    return clusters
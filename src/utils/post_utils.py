@@ -1,21 +1,40 @@
-import shutil
+import os
+import html
 import json
+import shutil
 import math
 import textwrap
-from io import BytesIO
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-import requests
-from PIL import Image
-import matplotlib.pyplot as plt
-import src.utils.sys_utils
+from PIL import Image, ImageDraw, ImageFont
+from src.utils import json_utils, sys_utils
+from src.utils.downloader import download_all
+from src.utils.phash import PerceptualIndex
+
 
+SNAPSHOT_MANIFEST = '.snapshot_manifest.json'
+
+
+def stable_sync(src, dst, incremental=False, max_workers=8):
+    """
+    Back up src into a new timestamped folder under dst.
 
-def stable_sync(src, dst):
-    if not Path(src).exists():
+    A full sync copies everything and renames src out of the way. An incremental sync leaves
+    src in place and only copies files that are new or changed since the latest snapshot.
+    Unchanged files are hard-linked from that snapshot, or referenced from it in the manifest
+    where the destination does not support hard links. Each snapshot's manifest is what
+    verify_snapshot and restore_snapshot work from.
+    """
+    src = Path(src)
+    if not src.exists():
         print(f"{src} does not exist")
         return
-        
+
+    if incremental:
+        return _snapshot_sync(src, Path(dst), max_workers)
+
     dst = Path(dst) / datetime.now().strftime("%m%d_%H%M")
     dst.mkdir(parents=True)
 
@@ -29,30 +48,196 @@ def stable_sync(src, dst):
     src.rename(src.parent / datetime.now().strftime("%m%d_%H%M"))
 
 
-def img_to_grid(path, save_path, dpi=72, unique_meta=False, width=3):
-    with open(path) as f:
-        data = json.load(f)
+def _snapshot_sync(src, dst, max_workers=8):
+    previous = latest_snapshot(dst)
+    previous_files = previous['files'] if previous else {}
+    # content hash -> entry of the previous snapshot, so renamed or touched files are still linked
+    by_hash = {entry['sha256']: entry for entry in previous_files.values()}
+
+    snapshot = dst / datetime.now().strftime("%m%d_%H%M%S")
+    snapshot.mkdir(parents=True)
+
+    def sync_file(path):
+        rel = path.relative_to(src).as_posix()
+        stat = path.stat()
+        old = previous_files.get(rel)
+
+        if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            sha256 = old['sha256']  # size and mtime unchanged, skip re-hashing
+        else:
+            sha256 = sys_utils.file_hash(path)
+
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256, 'stored_in': snapshot.name}
+        target = snapshot / rel
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        source_entry = old if old and old['sha256'] == sha256 else by_hash.get(sha256)
+        if source_entry:
+            try:
+                os.link(dst / source_entry['stored_in'] / source_entry['path'], target)
+            except OSError:
+                # e.g. Google Drive mounts: keep the bytes where they already are
+                entry['stored_in'] = source_entry['stored_in']
+                entry['path'] = source_entry['path']
+            return rel, entry, 'linked'
+
+        shutil.copy2(path, target)
+        return rel, entry, 'copied'
+
+    files = {}
+    counts = {'copied': 0, 'linked': 0}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for rel, entry, action in executor.map(sync_file, (p for p in src.rglob('*') if p.is_file())):
+            entry.setdefault('path', rel)
+            files[rel] = entry
+            counts[action] += 1
+
+    json_utils.write_to_json({
+        'created': datetime.now().timestamp(),
+        'source': str(src),
+        'previous': previous['name'] if previous else None,
+        'files': files,
+    }, snapshot / SNAPSHOT_MANIFEST)
+
+    print(f"Snapshot {snapshot}: {counts['copied']} copied, {counts['linked']} unchanged")
+    return snapshot
+
+
+def load_snapshot(snapshot_dir):
+    snapshot_dir = Path(snapshot_dir)
+    manifest = json.loads((snapshot_dir / SNAPSHOT_MANIFEST).read_text())
+    manifest['name'] = snapshot_dir.name
+    return manifest
+
+
+def latest_snapshot(dst):
+    manifests = []
+    for manifest_path in Path(dst).glob(f'*/{SNAPSHOT_MANIFEST}'):
+        try:
+            manifests.append(load_snapshot(manifest_path.parent))
+        except json.JSONDecodeError:
+            continue  # a snapshot interrupted before its manifest was written
+    return max(manifests, key=lambda m: m['created'], default=None)
+
+
+def _stored_path(snapshot_dir, entry):
+    return Path(snapshot_dir).parent / entry['stored_in'] / entry['path']
+
+
+def verify_snapshot(snapshot_dir, deep=False, max_workers=8):
+    """Files of a snapshot that are missing or differ from its manifest. deep re-hashes every file instead of checking sizes."""
+    files = load_snapshot(snapshot_dir)['files']
+
+    def check(item):
+        rel, entry = item
+        path = _stored_path(snapshot_dir, entry)
+        if not path.exists():
+            return rel, 'missing'
+        if path.stat().st_size != entry['size']:
+            return rel, 'size mismatch'
+        if deep and sys_utils.file_hash(path) != entry['sha256']:
+            return rel, 'hash mismatch'
+        return rel, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return {rel: problem for rel, problem in executor.map(check, files.items()) if problem}
+
+
+def restore_snapshot(snapshot_dir, dest, max_workers=8):
+    """Rebuild the tree a snapshot was taken from in dest, skipping files that already match."""
+    files = load_snapshot(snapshot_dir)['files']
+    dest = Path(dest)
+
+    def restore(item):
+        rel, entry = item
+        target = dest / rel
+        if target.exists() and target.stat().st_size == entry['size'] and sys_utils.file_hash(target) == entry['sha256']:
+            return False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(_stored_path(snapshot_dir, entry), target)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        restored = sum(executor.map(restore, files.items()))
+
+    print(f"Restored {restored} of {len(files)} files to {dest}")
+    return restored
+
+
+def load_records(source):
+    """Records from a run log path, or an iterable of records such as OutputCatalog.query(...)."""
+    if isinstance(source, (str, Path)):
+        return json_utils.iter_records(source)
+    return iter(source)
+
+
+def resolve_local_images(data, output_dir='./output/images', max_workers=8):
+    """Local path of each entry's first output image, downloading only the ones not saved yet."""
+    paths = [
+        (entry.get('local_paths') or [None])[0]
+        or os.path.join(output_dir, str(entry['id']), os.path.basename(entry['output'][0]))
+        for entry in data
+    ]
+    missing = [(entry['output'][0], path) for entry, path in zip(data, paths) if not os.path.exists(path)]
+    if missing:
+        print(f"Downloading {len(missing)} of {len(paths)} images not found under {output_dir}")
+        download_all(missing, max_workers)
+    return [path if os.path.exists(path) else None for path in paths]
+
+
+def load_thumbnail(path, size):
+    if path is None:
+        return None
+    img = Image.open(path)
+    img.draft('RGB', size)  # JPEGs decode straight at a reduced scale
+    img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return img.convert('RGB')
+
+
+def load_font(size):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        pass
+    try:
+        return ImageFont.load_default(size=size)  # Pillow >= 10.1
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def img_to_grid(path, save_path, dpi=72, unique_meta=False, width=3, output_dir='./output/images', grid_width=3000):
+    data = list(load_records(path))
+    if not data:
+        print(f"No records to grid in {path}")
+        return
 
     total = len(data)
     width = min(width, total) 
     height = math.ceil(total / width)
 
-    fig_width = 3000 / dpi  
-    fig_height = (fig_width / width) * height
-
-    font_size = 10 * (3 / width)
-    wrap_length = int(0.2 * (3000 / width))
+    cell_size = grid_width // width
+    font_size = max(12, cell_size // 40)
+    wrap_length = int(cell_size / (font_size * 0.55))
+    line_height = int(font_size * 1.3)
+    text_height = line_height * 3
+    padding = font_size // 2
 
-    fig, axs = plt.subplots(height, width, figsize=(fig_width, fig_height))
     keys = ["guidance_scale", "strength", "seed", "steps", "H", "W"]
     seen_meta = {}
 
-    for i, ax in enumerate(axs.flatten()):
-        if i < total:
-            entry = data[i]
-            img = Image.open(BytesIO(requests.get(entry['output'][0]).content))
-            ax.imshow(img)
-            ax.axis('off')
+    grid = Image.new('RGB', (cell_size * width, (cell_size + text_height) * height), 'white')
+    draw = ImageDraw.Draw(grid)
+    font = load_font(font_size)
+
+    image_paths = resolve_local_images(data, output_dir)
+    thumb_size = (cell_size - 2 * padding, cell_size - 2 * padding)
+
+    with ThreadPoolExecutor() as executor:
+        thumbnails = executor.map(lambda image_path: load_thumbnail(image_path, thumb_size), image_paths)
+
+        for i, (entry, thumbnail) in enumerate(zip(data, thumbnails)):
+            x = (i % width) * cell_size
+            y = (i // width) * (cell_size + text_height)
 
             meta = {k: entry['meta'][k] for k in keys if k in entry['meta']}
             if unique_meta:
@@ -61,81 +246,152 @@ def img_to_grid(path, save_path, dpi=72, unique_meta=False, width=3):
 
             meta_str = ', '.join([f"{k}: {v}" for k, v in meta.items()])
             wrapped_meta = textwrap.fill(meta_str, wrap_length)
-            ax.set_title(wrapped_meta, fontsize=font_size)
+            draw.multiline_text((x + padding, y + padding), wrapped_meta, fill='black', font=font)
 
-    if total < width * height:
-        for ax in axs.flatten()[total:]:
-            ax.axis('off')
+            if thumbnail is not None:
+                grid.paste(thumbnail, (x + (cell_size - thumbnail.width) // 2, y + text_height + (cell_size - thumbnail.height) // 2))
 
-    plt.tight_layout()
-    plt.savefig(save_path, dpi=dpi)
+    grid.save(save_path, dpi=(dpi, dpi))
 
-def web_grid(path, bg_color, dir_name="web_files"):
-    with open(path) as f:
-        data = json.load(f)
-
-    sys_utils.create_dirs(dir_name) 
+def web_grid(path, bg_color, dir_name="web_files", output_dir='./output/images', page_size=100, thumb_size=200,
+             collapse_duplicates=False, duplicate_threshold=6):
+    sys_utils.create_dirs([dir_name, f"{dir_name}/thumbs", f"{dir_name}/pages"])
 
+    # The first page is written into index.html, later pages are scripts main.js loads on scroll
     with open(f"{dir_name}/index.html", 'w') as f:
-        f.write(generate_html(data, bg_color))
+        duplicates = PerceptualIndex(duplicate_threshold) if collapse_duplicates else None
+        page_files = write_html(f, load_records(path), bg_color, dir_name, output_dir, page_size, thumb_size, duplicates)
+
+    with open(f"{dir_name}/pages/manifest.js", 'w') as f:
+        f.write(f"var GRID_PAGES = {json.dumps(page_files)};\n")
 
     with open(f"{dir_name}/style.css", 'w') as f:
         f.write(generate_css(bg_color))
 
     with open(f"{dir_name}/main.js", 'w') as f:
-        f.write(generate_js(data))
+        f.write(generate_js())
 
 
-def generate_html(data, bg_color):
-    common_meta = {k: data[0]['meta'][k] for k in ["guidance_scale", "strength", "seed", "steps", "H", "W"] if k in data[0]['meta']}
-    common_meta['prompt'] = data[0]['meta'].get('prompt', '')  
+def make_thumbnails(image_path, name, dir_name, thumb_size):
+    """1x and 2x thumbnails for srcset, reusing ones that are newer than the source image."""
+    thumbs = []
+    for scale in (1, 2):
+        thumb_path = f"thumbs/{name}_{thumb_size * scale}.jpg"
+        full_path = os.path.join(dir_name, thumb_path)
+        if not os.path.exists(full_path) or os.path.getmtime(full_path) < os.path.getmtime(image_path):
+            load_thumbnail(image_path, (thumb_size * scale, thumb_size * scale)).save(full_path, quality=85)
+        thumbs.append(thumb_path)
+    return thumbs
 
-    unique_meta_list = []
 
-    for entry in data:
-        meta = {k: entry['meta'][k] for k in ["guidance_scale", "strength", "seed", "steps", "H", "W", "prompt"] if k in entry['meta']}
-        unique_meta = {k: v for k, v in meta.items() if k not in common_meta or common_meta[k] != v}
-        unique_meta_list.append(unique_meta)
+def generate_cell(entry, image_path, meta_str, dir_name, thumb_size):
+    img_url = html.escape(entry['output'][0])
+    meta_str = html.escape(meta_str)
 
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-      <title>Image Grid</title>
-      <link rel="stylesheet" href="style.css"> 
-    </head>
-    <body style="background-color: {bg_color};">
-      <div class="grid">
-    """
+    if image_path:
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        thumb_1x, thumb_2x = make_thumbnails(image_path, f"{entry['id']}_{stem}", dir_name, thumb_size)
+        img = f'<img src="{thumb_1x}" srcset="{thumb_1x} 1x, {thumb_2x} 2x" loading="lazy" width="{thumb_size}" height="{thumb_size}" alt="{meta_str}">'
+    else:
+        img = f'<img src="{img_url}" loading="lazy" width="{thumb_size}" height="{thumb_size}" alt="{meta_str}">'
 
-    for i, entry in enumerate(data):
-        img_url = entry['output'][0]
-        meta_str = ', '.join([f"{k}: {v}" for k, v in unique_meta_list[i].items()])
-        html += f"""
+    return f"""
         <div class="cell" data-url="{img_url}" data-meta="{meta_str}" onclick="downloadImage(this)">
-          <img src="{img_url}">
+          {img}
           <div class="overlay">
             <div class="text">{meta_str}</div>
           </div>
         </div>
         """
 
-    common_meta_str = ', '.join([f"{k}: {v}" for k, v in common_meta.items()])
 
-    html += f"""
+def collapse_page(page, image_paths, duplicates, executor):
+    """Drop entries whose image is a near-duplicate of one already in the grid."""
+    hashes = executor.map(lambda image_path: image_path and duplicates.hash(image_path), image_paths)
+    kept = []
+    for entry, image_path, image_hash in zip(page, image_paths, hashes):
+        if image_path is None or duplicates.nearest(image_hash) is None:
+            if image_path is not None:
+                duplicates.add(image_path, image_hash)
+            kept.append((entry, image_path))
+    return [entry for entry, _ in kept], [image_path for _, image_path in kept]
+
+
+def write_html(f, data, bg_color, dir_name, output_dir='./output/images', page_size=100, thumb_size=200, duplicates=None):
+    # data may be a generator over the run log, so everything is derived in a single pass
+    data = iter(data)
+    first = next(data, None)
+    if first is None:
+        return []
+
+    common_meta = {k: first['meta'][k] for k in ["guidance_scale", "strength", "seed", "steps", "H", "W"] if k in first['meta']}
+    common_meta['prompt'] = first['meta'].get('prompt', '')  
+
+    f.write(f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+      <title>Image Grid</title>
+      <link rel="stylesheet" href="style.css"> 
+    </head>
+    <body style="background-color: {bg_color};">
+      <div class="grid">
+    """)
+
+    page_files = []
+    records = itertools.chain([first], data)
+
+    with ThreadPoolExecutor() as executor:
+        for page_number in itertools.count():
+            page = list(itertools.islice(records, page_size))
+            if not page:
+                break
+
+            image_paths = resolve_local_images(page, output_dir)
+            if duplicates is not None:
+                page, image_paths = collapse_page(page, image_paths, duplicates, executor)
+                if not page:
+                    continue
+
+            meta_strs = []
+            for entry in page:
+                meta = {k: entry['meta'][k] for k in ["guidance_scale", "strength", "seed", "steps", "H", "W", "prompt"] if k in entry['meta']}
+                unique_meta = {k: v for k, v in meta.items() if k not in common_meta or common_meta[k] != v}
+                meta_strs.append(', '.join([f"{k}: {v}" for k, v in unique_meta.items()]))
+
+            cells = executor.map(
+                lambda args: generate_cell(*args, dir_name, thumb_size),
+                zip(page, image_paths, meta_strs)
+            )
+
+            if page_number == 0:
+                f.writelines(cells)
+                continue
+
+            page_file = f"pages/page-{page_number + 1:04d}.js"
+            with open(os.path.join(dir_name, page_file), 'w') as page_f:
+                page_f.write(f"appendCells({json.dumps(list(cells))});\n")
+            page_files.append(page_file)
+
+    common_meta_str = html.escape(', '.join([f"{k}: {v}" for k, v in common_meta.items()]))
+
+    f.write(f"""
       </div>
 
+      <div id="sentinel"></div>
+
       <div class="common-info">
         <p><strong>Common Meta:</strong> {common_meta_str}</p> 
       </div>
 
+      <script src="pages/manifest.js"></script>
       <script src="main.js"></script>
 
     </body>
     </html>
-    """
+    """)
 
-    return html
+    return page_files
 
 
 def generate_css(bg_color):
@@ -162,6 +418,7 @@ def generate_css(bg_color):
     .cell img {{
       width: 200px;
       height: 200px;
+      object-fit: cover;
     }}
     
     .overlay {{
@@ -200,8 +457,36 @@ def generate_css(bg_color):
     }}
   """
 
-def generate_js(data):
+def generate_js():
   return """
+    var nextPage = 0;
+    var loadingPage = false;
+    var sentinel = document.getElementById('sentinel');
+
+    var observer = new IntersectionObserver(function(entries) {
+      if (entries[0].isIntersecting) loadNextPage();
+    }, {rootMargin: '1000px'});
+
+    function loadNextPage() {
+      if (loadingPage || typeof GRID_PAGES === 'undefined' || nextPage >= GRID_PAGES.length) return;
+      loadingPage = true;
+      // Pages are scripts rather than JSON so they also load from file:// URLs
+      let script = document.createElement('script');
+      script.src = GRID_PAGES[nextPage++];
+      document.body.appendChild(script);
+    }
+
+    function appendCells(cells) {
+      let grid = document.querySelector('.grid');
+      cells.forEach(function(cell) { grid.insertAdjacentHTML('beforeend', cell); });
+      loadingPage = false;
+      // Re-observing reports the sentinel again, loading another page if it is still in view
+      observer.unobserve(sentinel);
+      observer.observe(sentinel);
+    }
+
+    observer.observe(sentinel);
+
     function downloadImage(element) {
       let url = element.getAttribute('data-url');
       let meta = element.getAttribute('data-meta');
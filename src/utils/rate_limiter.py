@@ -0,0 +1,93 @@
+# rate_limiter.py
+
+import time
+import threading
+from urllib.parse import urlparse
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every caller that talks to one host.
+
+    Callers only block once they have used up the burst. A rate-limited response halves the
+    rate (down to min_rate) and each normal response grows it back towards the configured rate.
+
+    Attributes:
+    rate (float): Requests per second allowed once the burst is spent.
+    burst (int): Requests that can be sent back to back.
+    min_rate (float): Floor for the adaptive slowdown.
+    recovery (float): Factor the rate grows by after each request that was not rate limited.
+    """
+
+    def __init__(self, rate=1.0, burst=1, min_rate=None, recovery=1.1):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate or rate / 16
+        self.recovery = recovery
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def slow_down(self, retry_after=None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            if retry_after:
+                self.blocked_until = time.monotonic() + retry_after
+
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate * self.recovery)
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+_limiters = {}
+
+
+def configure(host, rate, burst=1, **kwargs):
+    _limiters[host] = RateLimiter(rate, burst, **kwargs)
+    return _limiters[host]
+
+
+def for_url(url):
+    return _limiters.get(urlparse(url).hostname)
+
+
+def is_rate_limited(response, inspect_body=True):
+    if response.status_code == 429:
+        return True
+    if not inspect_body:
+        return False
+
+    # The Stable API also reports limits as a 200 with an error status in the body. Successful
+    # bodies echo the prompt and meta, so they are never treated as a limit
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    if isinstance(body, dict) and body.get('status') == 'success':
+        return False
+    return 'rate limit' in response.text.lower()
+
+
+def retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,121 @@
+# request_cache.py
+
+import os
+import json
+import time
+import threading
+from pathlib import Path
+
+from src.utils.file_cache import SharedByPath, atomic_write, evict_lru, mark_used
+from src.utils.json_utils import canonical_hash
+
+
+class RequestCache(SharedByPath):
+    """
+    On-disk cache of successful Stable API responses, keyed by the request payload.
+
+    Only payloads with a fixed seed are cached, since those are the ones that render the same
+    image again. An entry is a hit while it is younger than ttl and its local images still
+    exist. The oldest entries are evicted once the cache grows past max_bytes.
+
+    Jobs that come back as 'processing' carry their cache key and folder in processing.json,
+    so they are stored by complete() once the scheduler, the webhook or a resumed sweep fetches them.
+
+    Attributes:
+    cache_dir (str): Folder the entries are stored in.
+    ttl (float): Seconds an entry stays valid.
+    max_bytes (int): Size the cache is trimmed back to after a write.
+    bypass (bool): Always miss on lookups. Fresh responses are still stored.
+    """
+
+    IGNORED_KEYS = ('key', 'webhook', 'track_id')
+
+    def __init__(self, cache_dir='./output/cache/requests', ttl=7 * 24 * 3600, max_bytes=64 * 1024 * 1024, bypass=False):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+        self.lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.size = sum(path.stat().st_size for path in self.cache_dir.glob('*/*.json'))
+
+    @staticmethod
+    def cacheable(payload):
+        return str(payload.get('seed')).strip().lower() not in ('none', 'null', '')
+
+    def key(self, payload):
+        return canonical_hash(payload, exclude=self.IGNORED_KEYS)
+
+    def entry_path(self, key):
+        return self.cache_dir / key[:2] / f'{key}.json'
+
+    def get(self, payload):
+        if not self.cacheable(payload):
+            return None
+        if self.bypass:
+            self._count('bypassed')
+            return None
+
+        path = self.entry_path(self.key(payload))
+        try:
+            entry = json.loads(path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._count('misses')
+            return None
+
+        if time.time() - entry['created'] > self.ttl or not all(os.path.exists(p) for p in entry['paths']):
+            self._remove(path)
+            self._count('misses')
+            return None
+
+        mark_used(path)
+        self._count('hits')
+        return {**entry['response'], 'cached': True, 'local_paths': entry['paths']}
+
+    def put(self, payload, response, paths):
+        if not self.cacheable(payload):
+            return
+        self.put_key(self.key(payload), response, paths)
+
+    def put_key(self, key, response, paths):
+        paths = list(paths)
+        if response.get('status') != 'success' or not all(paths):
+            return
+
+        path = self.entry_path(key)
+        path.parent.mkdir(exist_ok=True)
+        data = json.dumps({'created': time.time(), 'response': response, 'paths': paths})
+
+        with self.lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            atomic_write(path, lambda tmp_path: Path(tmp_path).write_text(data))
+            self.size += len(data) - old_size
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            self.size = evict_lru(self.cache_dir.glob('*/*.json'), self.max_bytes)
+
+    def clear(self):
+        for path in self.cache_dir.glob('*/*.json'):
+            path.unlink()
+        self.size = 0
+
+    def _remove(self, path):
+        with self.lock:
+            if path.exists():
+                self.size -= path.stat().st_size
+                path.unlink()
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+
+def complete(record, response, paths):
+    """Cache a job that was still processing when it was requested, now that it has finished."""
+    if record and record.get('cache_key') and record.get('cache_dir'):
+        RequestCache.open(record['cache_dir']).put_key(record['cache_key'], response, paths)
@@ -1,13 +1,16 @@
-from src.utils.json_utils import write_to_json, append_to_json
+from src.utils.json_utils import write_to_json, append_to_jsonl, lookup_record, add_tombstones, queue_removal
 from src.utils.sys_utils import create_dirs
-from src.utils.image_utils import image_download
+from src.utils.downloader import download_all
+from src.utils.catalog import OutputCatalog
+from src.utils import request_cache
 import datetime, os, json
 
 class ResponseProcessor:
-    def __init__(self, response, output_dir='./output/images/'):
+    def __init__(self, response, output_dir='./output/images/', catalog=None):
         self.response = response
         self.status = response['status']
         self.output_dir = output_dir
+        self.catalog = catalog or OutputCatalog.open(os.path.join(output_dir, 'catalog.db'))
 
     def process(self):
         if self.status == 'success':
@@ -23,6 +26,7 @@ class ResponseProcessor:
         id_directory = self.make_dirs(self.response["id"])
         processing_data = self.get_processing_data()
         self.write_and_append(id_directory, processing_data, 'processing.json')
+        self.catalog.index(self.response)
 
         return self.response['status'], self.response, os.path.join(id_directory, 'processing.json')
 
@@ -31,8 +35,10 @@ class ResponseProcessor:
         self.response['date_time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         self.write_and_append(id_directory, self.response, 'master.json')
-        self.download_images(self.response['output'], self.response["id"])
-        
+        paths = self.download_images(self.response['output'], self.response["id"])
+        self.catalog.index(self.response, paths)
+        self.complete_processing(paths)
+
         return self.response['status'], self.response, os.path.join(id_directory, f'{self.response["id"]}.json')
 
     def process_error_response(self):
@@ -44,8 +50,20 @@ class ResponseProcessor:
         print(f"Message: {message}")
         print(f"Tips: {tips}")
 
+        self.catalog.index(self.response)
         return status, self.response, None
 
+    def complete_processing(self, paths):
+        # A job that was queued as 'processing' is finished: cache it and stop polling for it. The
+        # tombstone goes first, so it also covers a 'processing' record appended after the lookup, or
+        # a webhook callback that arrives before the job was ever queued
+        processing_path = os.path.join(self.output_dir, 'processing.json')
+        add_tombstones(processing_path, [self.response['id']])
+        record = lookup_record(processing_path, self.response['id'])
+        request_cache.complete(record, self.response, paths)
+        if record is not None:
+            queue_removal(processing_path, [self.response['id']])
+
     def make_dirs(self, id):
         id_directory = os.path.join(self.output_dir, f'{id}/json/')
         create_dirs(id_directory)
@@ -53,19 +71,20 @@ class ResponseProcessor:
         return id_directory
 
     def get_processing_data(self):
-        keys = ['eta', 'fetch_result', 'id']
+        keys = ['eta', 'fetch_result', 'id', 'cache_key', 'cache_dir']
         processing_data = {key: self.response[key] for key in keys if key in self.response}
         processing_data['available'] = self.calculate_eta(self.response['eta'])
+        processing_data['available_at'] = (datetime.datetime.now() + datetime.timedelta(seconds=float(self.response['eta']))).timestamp()
         return processing_data
 
     def write_and_append(self, id_directory, data, filename):
         write_to_json(self.response, os.path.join(id_directory, f'{self.response["id"]}.json'))
-        append_to_json(data, os.path.join(self.output_dir, filename))
+        append_to_jsonl(data, os.path.join(self.output_dir, filename))
 
     def download_images(self, image_urls, id):
-        for image_url in image_urls:
-          image_name = os.path.basename(image_url)
-          image_download(image_url, os.path.join(self.output_dir, f'{id}/{image_name}'))
+        return download_all(
+            [(image_url, os.path.join(self.output_dir, f'{id}/{os.path.basename(image_url)}')) for image_url in image_urls]
+        )
 
     def calculate_eta(self, eta):
         current_time = datetime.datetime.now()
@@ -1,8 +1,9 @@
 import os
 import json
-import requests
 import time
 from urllib.parse import urlparse
+from src.utils import http_client, json_utils
+from src.utils.downloader import download_file
 
 class SuperImageFetcher:
 
@@ -18,24 +19,20 @@ class SuperImageFetcher:
         headers = {
             'Content-Type': 'application/json'
         }
-        response = requests.post(fetch_url, headers=headers, data=payload)
+        response = http_client.post(fetch_url, headers=headers, data=payload)
         data = response.json()
         if data.get('status') == 'success':
             img_url = data.get('output', [None])[0]  # Assume the first item in 'output' is the image URL
             if img_url:
-                img_response = requests.get(img_url)
-                with open(path, 'wb') as f:
-                    f.write(img_response.content)
+                download_file(img_url, path)
 
     def get_fetch_result_value(self, master_json_path):
         fetch_results = []
-        with open(master_json_path, 'r') as json_file:
-            for line in json_file:
-                data = json.loads(line)
-                fetch_result = data.get('fetch_result', None)
-                file_ext = data.get('meta', {}).get('ext', '')
-                if fetch_result:
-                    fetch_results.append((fetch_result, file_ext))
+        for data in json_utils.iter_records(master_json_path):
+            fetch_result = data.get('fetch_result', None)
+            file_ext = data.get('meta', {}).get('ext', '')
+            if fetch_result:
+                fetch_results.append((fetch_result, file_ext))
         return fetch_results
 
     def fetch_images(self):
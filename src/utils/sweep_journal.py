@@ -0,0 +1,70 @@
+# sweep_journal.py
+
+import time
+import threading
+from pathlib import Path
+
+from src.utils import json_utils
+
+
+class SweepJournal:
+    """
+    Append-only checkpoint log of a StableAPI sweep.
+
+    Every combo is recorded when it is dispatched and again when its response arrives, so a
+    sweep that is interrupted can be resumed: completed combos are skipped, combos that were
+    still processing are re-polled by id and everything else is dispatched again.
+
+    Attributes:
+    path (str): JSON Lines file the journal is written to.
+    resume (bool): Keep the existing journal. Otherwise it is cleared and the sweep starts over.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.state = {}
+        self.skipped = 0
+
+        if resume:
+            for record in json_utils.iter_records(self.path):
+                self.state[record['combo']] = record
+        else:
+            json_utils.rewrite_records([], self.path, index_key=None)
+
+    @staticmethod
+    def key(combo):
+        return json_utils.canonical_hash(combo)
+
+    def entry(self, combo):
+        return self.state.get(self.key(combo))
+
+    def is_completed(self, combo):
+        entry = self.entry(combo)
+        return entry is not None and entry['event'] == 'completed'
+
+    def pending(self, combos):
+        for combo in combos:
+            if self.is_completed(combo):
+                self.skipped += 1
+                continue
+            yield combo
+
+    def record(self, combo, event, response=None):
+        record = {'combo': self.key(combo), 'event': event, 'time': time.time()}
+        if response and response.get('id') is not None:
+            record['id'] = response['id']
+        elif event != 'dispatched':
+            previous = self.entry(combo)
+            if previous and 'id' in previous:
+                record['id'] = previous['id']
+
+        with self.lock:
+            json_utils.append_to_jsonl(record, self.path, index_key=None)
+            self.state[record['combo']] = record
+
+    def record_response(self, combo, response):
+        status = response.get('status') if response else None
+        event = {'success': 'completed', 'processing': 'processing'}.get(status, 'failed')
+        self.record(combo, event, response)
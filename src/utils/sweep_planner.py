@@ -0,0 +1,112 @@
+# sweep_planner.py
+
+import math
+import random
+import itertools
+
+
+class SweepPlanner:
+    """
+    Lazily yields the option combinations of a StableAPI sweep.
+
+    Nothing is materialised up front, so a large sweep can start rendering straight away.
+    The order is deterministic for a given strategy and seed, which lets several runs
+    split one sweep between them with shard.
+
+    Attributes:
+    options (dict): Option name to list of values, as returned by StableAPI.set_options.
+    strategy (str): 'grid' for every combination in itertools.product order, 'random' for a random subset, 'lhs' for a Latin hypercube over the numeric options.
+    samples (int, optional): Number of combinations to draw for 'random' and 'lhs'.
+    seed (int): Seed for the sampling strategies, so that every shard draws the same plan.
+    shard (str or tuple, optional): 'i/N' or (i, N) to keep only every N-th combination starting at i.
+    """
+
+    STRATEGIES = ('grid', 'random', 'lhs')
+
+    def __init__(self, options, strategy='grid', samples=None, seed=0, shard=None):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown sweep strategy '{strategy}', expected one of {self.STRATEGIES}")
+        if strategy != 'grid' and not samples:
+            raise ValueError(f"The '{strategy}' strategy needs a number of samples")
+
+        self.keys = list(options)
+        self.values = [value if isinstance(value, list) else [value] for value in options.values()]
+        self.sizes = [len(value) for value in self.values]
+        self.total = math.prod(self.sizes)
+        self.strategy = strategy
+        self.samples = min(samples, self.total) if samples else None
+        self.seed = seed
+        self.shard = self.parse_shard(shard)
+
+    @staticmethod
+    def parse_shard(shard):
+        if shard is None:
+            return None
+        if isinstance(shard, str):
+            shard = tuple(int(part) for part in shard.split('/'))
+
+        index, count = shard
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index}/{count}")
+        return index, count
+
+    def __len__(self):
+        planned = self.total if self.strategy == 'grid' else self.samples
+        if self.shard is None:
+            return planned
+        index, count = self.shard
+        return len(range(index, planned, count))
+
+    def __iter__(self):
+        positions = self._positions()
+        if self.shard:
+            index, count = self.shard
+            positions = itertools.islice(positions, index, None, count)
+
+        for position in positions:
+            yield {key: values[i] for key, values, i in zip(self.keys, self.values, position)}
+
+    def _positions(self):
+        if self.strategy == 'grid':
+            return itertools.product(*(range(size) for size in self.sizes))
+
+        rng = random.Random(self.seed)
+        if self.strategy == 'random':
+            # random.sample over a range draws indices without building the full product
+            return (self._unravel(index) for index in rng.sample(range(self.total), self.samples))
+        return self._latin_hypercube(rng)
+
+    def _unravel(self, index):
+        # itertools.product order: the last option varies fastest
+        position = []
+        for size in reversed(self.sizes):
+            index, i = divmod(index, size)
+            position.append(i)
+        return tuple(reversed(position))
+
+    def _latin_hypercube(self, rng):
+        n = self.samples
+        columns = []
+        for values in self.values:
+            order = self._numeric_order(values)
+            if order is None:
+                columns.append([rng.randrange(len(values)) for _ in range(n)])
+                continue
+
+            # one sample per stratum along the axis, strata shuffled independently per axis
+            strata = list(range(n))
+            rng.shuffle(strata)
+            columns.append([order[int((s + rng.random()) / n * len(order))] for s in strata])
+
+        return zip(*columns)
+
+    @staticmethod
+    def _numeric_order(values):
+        """Indices of values sorted numerically, or None if the option is not numeric."""
+        if len(values) < 2:
+            return None
+        try:
+            numbers = [float(value) for value in values]
+        except (TypeError, ValueError):
+            return None
+        return sorted(range(len(values)), key=numbers.__getitem__)
@@ -1,8 +1,15 @@
+import io
 import os
+import zlib
+import functools
 import shutil
+import hashlib
+import itertools
 import pandas as pd
 from pathlib import Path
-from zipfile import ZipFile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED, ZIP64_LIMIT
 from datetime import datetime
 from dotenv import load_dotenv
 from docx import Document
@@ -55,17 +62,127 @@ def create_dirs(dirs):
         Path(path).mkdir(parents=True, exist_ok=True)
 
 
-def zip_folder(folder_path, output_filename):
-    with ZipFile(output_filename, 'w') as zipf:
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                zipf.write(
-                    os.path.join(root, file),
-                    arcname=os.path.relpath(
-                        os.path.join(root, file),
-                        folder_path
-                    )
-                )
+# Formats that are already compressed gain nothing from deflate, so they are stored as-is
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.zip', '.gz', '.mp4'}
+
+def zip_folder(folder_path, output_filename, workers=None, split_size=None, compresslevel=6):
+    """
+    Archive a folder, storing images uncompressed and deflating everything else in worker processes.
+
+    Entries are streamed into the archive in walk order. With split_size (bytes) a new archive
+    (name_001.zip, name_002.zip, ...) is started once the current one would grow past it, so each
+    part is a complete zip on its own. Returns the paths of the archives written.
+
+    If this Python's ZipFile cannot take pre-compressed entries, everything is deflated by
+    ZipFile.write in this process instead, which is slower but produces the same archive.
+    """
+    paths = []
+    for root, _, files in os.walk(folder_path):
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            if os.path.abspath(path) != os.path.abspath(output_filename):
+                paths.append(path)
+
+    archives = []
+    zipf = None
+    workers = workers or os.cpu_count()
+    parallel = _supports_precompressed()
+
+    def open_archive():
+        if not split_size:
+            name = output_filename
+        else:
+            stem, ext = os.path.splitext(output_filename)
+            name = f'{stem}_{len(archives) + 1:03d}{ext or ".zip"}'
+        archives.append(name)
+        return ZipFile(name, 'w', allowZip64=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        pending = iter(paths)
+
+        def fill():
+            # Bounded read-ahead keeps at most a few compressed entries in memory
+            for path in itertools.islice(pending, 2 * workers - len(window)):
+                compress_type = ZIP_STORED if Path(path).suffix.lower() in STORED_EXTENSIONS else ZIP_DEFLATED
+                future = executor.submit(_deflate_file, path, compresslevel) if parallel and compress_type == ZIP_DEFLATED else None
+                window.append((path, compress_type, future))
+
+        fill()
+        while window:
+            path, compress_type, future = window.popleft()
+            zinfo = ZipInfo.from_file(path, os.path.relpath(path, folder_path))
+            if future is None:
+                compressed = None
+                entry_size = zinfo.file_size
+            else:
+                crc, compressed = future.result()
+                entry_size = len(compressed)
+            fill()
+
+            if zipf is not None and split_size and zipf.fp.tell() + entry_size > split_size and zipf.filelist:
+                zipf.close()
+                zipf = None
+            if zipf is None:
+                zipf = open_archive()
+
+            if compressed is None:
+                zipf.write(path, zinfo.filename, compress_type=compress_type, compresslevel=compresslevel)
+            else:
+                _write_compressed(zipf, zinfo, crc, compressed)
+
+    if zipf is None:
+        zipf = open_archive()
+    zipf.close()
+    return archives
+
+@functools.lru_cache(maxsize=None)
+def _supports_precompressed():
+    """Check once that _write_compressed produces an archive this Python's zipfile reads back intact."""
+    data = b'zip_folder probe ' * 64
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    zinfo = ZipInfo('probe.txt', (2020, 1, 1, 0, 0, 0))
+    zinfo.file_size = len(data)
+    buffer = io.BytesIO()
+    try:
+        with ZipFile(buffer, 'w') as zipf:
+            _write_compressed(zipf, zinfo, zlib.crc32(data), compressed)
+            zipf.writestr('stored.txt', data)
+        with ZipFile(buffer) as zipf:
+            return zipf.testzip() is None and zipf.read('probe.txt') == data and zipf.read('stored.txt') == data
+    except Exception:
+        return False
+
+def _deflate_file(path, compresslevel):
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)  # raw deflate, as stored in zips
+    crc = 0
+    chunks = []
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+            chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    return crc, b''.join(chunks)
+
+def _write_compressed(zipf, zinfo, crc, compressed):
+    # ZipFile has no API for adding pre-compressed data, so the entry is written the way ZipFile.write
+    # does it, through ZipFile internals (fp, start_dir, NameToInfo, _didModify). Only used once
+    # _supports_precompressed has verified them on this Python
+    zinfo.compress_type = ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.compress_size = len(compressed)
+    zip64 = max(zinfo.file_size, zinfo.compress_size) > ZIP64_LIMIT
+
+    zipf.fp.seek(zipf.start_dir)
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    zipf.fp.write(compressed)
+    zipf.start_dir = zipf.fp.tell()
+
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf._didModify = True
 
 def read_excel(path):
     df = pd.read_excel(path)
@@ -97,3 +214,10 @@ def setup_logging(log_file):
 
 def calculate_token_cost(token_count, cost_per_token):
     return token_count / 1000 * cost_per_token
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
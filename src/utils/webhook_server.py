@@ -0,0 +1,180 @@
+# webhook_server.py
+
+import re
+import hmac
+import json
+import asyncio
+import secrets
+import threading
+
+from src.utils.response_processor import ResponseProcessor
+
+# Job ids end up in file paths, so only plain tokens are accepted
+_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+
+
+class WebhookServer:
+    """
+    Minimal asyncio HTTP listener that receives Stable API webhook callbacks.
+
+    Each JSON body POSTed to the listener is passed to the handler (ResponseProcessor by
+    default) on a worker thread, so slow image downloads never block the event loop.
+    Jobs that complete this way are also removed from processing.json, so polling skips them, and
+    a 'processing' record for them that arrives late is not appended again.
+
+    Only POSTs to /webhook/<token> are accepted, and url includes the token, so callbacks have to
+    come from whoever was given that URL. Bodies over max_body bytes and payloads whose id is not
+    a plain token are rejected before reaching the handler.
+
+    Attributes:
+    host (str): Interface to bind to. Use '0.0.0.0' only behind a tunnel or firewall.
+    port (int): Port to listen on. 0 picks a free port.
+    public_url (str, optional): Base URL the API reaches this listener at, e.g. a tunnel. Defaults to the local address.
+    output_dir (str): Folder passed to ResponseProcessor.
+    handler (callable, optional): Called with each payload instead of ResponseProcessor.
+    token (str, optional): Secret part of the callback path. Defaults to a random token.
+    max_body (int): Largest request body accepted, in bytes.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, public_url=None, output_dir='./output/images/', handler=None,
+                 token=None, max_body=1 << 20):
+        self.host = host
+        self.port = port
+        self.public_url = public_url
+        self.token = token or secrets.token_urlsafe(16)
+        self.max_body = max_body
+        self.output_dir = output_dir
+        self.handler = handler or self.process_payload
+        self.received = {}
+        self.condition = threading.Condition()
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    @property
+    def path(self):
+        return f'/webhook/{self.token}'
+
+    @property
+    def url(self):
+        if self.public_url:
+            return self.public_url.rstrip('/') + self.path
+        host = '127.0.0.1' if self.host in ('0.0.0.0', '') else self.host
+        return f'http://{host}:{self.port}{self.path}'
+
+    def start(self):
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self.server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if not self.loop:
+            return
+
+        async def shutdown():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def wait(self, ids, timeout=None):
+        """Block until a callback has arrived for every id. Returns the ids still missing."""
+        ids = {str(i) for i in ids}
+        with self.condition:
+            self.condition.wait_for(lambda: ids <= self.received.keys(), timeout)
+            return ids - self.received.keys()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, _, target = request_line.decode('latin-1').partition(' ')
+            target = target.rsplit(' ', 1)[0]
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length', 0))
+            if not 0 <= length <= self.max_body:
+                await self._respond(writer, 413, 'Payload Too Large')
+                return
+            body = await reader.readexactly(length)
+
+            if not hmac.compare_digest(target.encode(), self.path.encode()):
+                await self._respond(writer, 403, 'Forbidden')
+                return
+
+            if method.upper() != 'POST':
+                await self._respond(writer, 405, 'Method Not Allowed')
+                return
+
+            try:
+                payload = json.loads(body)
+            except json.JSONDecodeError:
+                await self._respond(writer, 400, 'Bad Request')
+                return
+
+            if not self._valid_payload(payload):
+                await self._respond(writer, 400, 'Bad Request')
+                return
+
+            await self._respond(writer, 200, 'OK')
+            self.loop.run_in_executor(None, self._dispatch, payload)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, code, reason):
+        body = json.dumps({'status': reason}).encode()
+        writer.write(
+            f'HTTP/1.1 {code} {reason}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+        writer.close()
+
+    @staticmethod
+    def _valid_payload(payload):
+        if not isinstance(payload, dict):
+            return False
+        id = payload.get('id')
+        return isinstance(id, (int, str)) and not isinstance(id, bool) and bool(_ID_PATTERN.fullmatch(str(id)))
+
+    def _dispatch(self, payload):
+        try:
+            self.handler(payload)
+        except Exception as e:
+            print(f"Error handling webhook for {payload.get('id')}: {e}")
+
+        with self.condition:
+            self.received[str(payload.get('id'))] = payload
+            self.condition.notify_all()
+
+    def process_payload(self, payload):
+        # A success also drops the job from processing.json, see ResponseProcessor.complete_processing
+        return ResponseProcessor(payload, self.output_dir).process()
@@ -0,0 +1,44 @@
+import types
+
+import pytest
+
+from src import chatbot
+
+
+class Completion(dict):
+    def __init__(self, content, usage=None):
+        super().__init__(usage=usage) if usage else super().__init__()
+        self.choices = [types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+
+
+class WordEncoder:
+    # Stands in for the tiktoken encoding, which is downloaded on first use
+    def encode(self, text):
+        return text.split()
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    monkeypatch.setattr(chatbot.tiktoken, 'get_encoding', lambda name: WordEncoder())
+    bot = chatbot.Chatbot('key', 'Be brief.', chat_history_path=tmp_path / 'history.json')
+    monkeypatch.setattr(chatbot.openai, 'ChatCompletion', types.SimpleNamespace(
+        create=lambda model, messages: Completion('Hello there.', {'prompt_tokens': 20, 'completion_tokens': 4})
+    ))
+    return bot
+
+
+def test_used_tokens_matches_full_recount(bot):
+    bot.chat('Hi, who are you?')
+    bot.chat('And what can you do?')
+
+    recount = sum(bot.count_message_tokens(m) for m in bot.messages) + bot.TOKENS_PER_REPLY
+    assert bot.used_tokens[0] == recount
+    assert [m['role'] for m in bot.messages] == ['system', 'user', 'assistant', 'user', 'assistant']
+
+
+def test_session_cost_records_api_usage(bot):
+    bot.chat('Hi')
+    bot.chat('Again')
+
+    assert bot.usage == {'prompt_tokens': 40, 'completion_tokens': 8, 'total_tokens': 48}
+    assert bot.session_cost[0] == 48
@@ -0,0 +1,95 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.utils import downloader
+
+DATA = bytes(range(256)) * 4
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves DATA, honouring Range unless the server says otherwise, and records each Range header."""
+
+    def do_GET(self):
+        server = self.server
+        server.ranges.append(self.headers.get('Range'))
+
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        start = int(match.group(1)) if match and server.honour_range else 0
+        if start >= len(DATA):
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = DATA[start:]
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        # a truncating server closes the connection halfway through the body it announced
+        self.wfile.write(body[:len(body) // 2] if server.truncate else body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.ranges, server.honour_range, server.truncate = [], True, False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/image.png'
+
+
+def test_resumes_part_file_with_range(server, tmp_path):
+    path = tmp_path / 'image.png'
+    (tmp_path / 'image.png.part').write_bytes(DATA[:100])
+
+    assert downloader.download_file(url(server), str(path)) == str(path)
+
+    assert path.read_bytes() == DATA
+    assert not (tmp_path / 'image.png.part').exists()
+    assert server.ranges == ['bytes=100-']
+
+
+def test_restarts_when_server_ignores_range(server, tmp_path):
+    server.honour_range = False
+    path = tmp_path / 'image.png'
+    (tmp_path / 'image.png.part').write_bytes(b'stale bytes')
+
+    assert downloader.download_file(url(server), str(path)) == str(path)
+
+    assert path.read_bytes() == DATA
+    assert server.ranges == ['bytes=11-']
+
+
+def test_restarts_after_416(server, tmp_path):
+    path = tmp_path / 'image.png'
+    (tmp_path / 'image.png.part').write_bytes(b'x' * (len(DATA) + 10))
+
+    assert downloader.download_file(url(server), str(path)) == str(path)
+
+    assert path.read_bytes() == DATA
+    assert server.ranges == [f'bytes={len(DATA) + 10}-', None]
+
+
+def test_truncated_body_never_creates_path(server, tmp_path, monkeypatch):
+    # chunks smaller than the body, so the bytes read before each cut-off reach the .part file
+    monkeypatch.setattr(downloader, 'CHUNK_SIZE', 64)
+    server.truncate = True
+    path = tmp_path / 'image.png'
+
+    assert downloader.download_file(url(server), str(path), max_attempts=3) is None
+
+    assert not path.exists()
+    assert (tmp_path / 'image.png.part').read_bytes() == DATA[:896]
+    assert server.ranges == [None, 'bytes=512-', 'bytes=768-']
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from src.utils import fetch_scheduler, image_processor, json_utils
+from src.utils.catalog import OutputCatalog
+from src.utils.response_processor import ResponseProcessor
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    return str(tmp_path)
+
+
+def queue_job(output_dir, id, eta=0):
+    processing = {'id': id, 'status': 'processing', 'eta': eta, 'fetch_result': f'https://api/fetch/{id}',
+                  'meta': {'prompt': 'a cat', 'strength': 0.6, 'seed': 1}}
+    ResponseProcessor(processing, f'{output_dir}/').process()
+
+
+def fake_api(monkeypatch, responses):
+    calls = []
+
+    def send_request(id, api_key):
+        calls.append(id)
+        return dict(responses[id])
+
+    def download_images(urls, output_path):
+        return [os.path.join(output_path, os.path.basename(url)) for url in urls]
+
+    monkeypatch.setattr(fetch_scheduler, 'send_request', send_request)
+    monkeypatch.setattr(fetch_scheduler, 'download_images', download_images)
+    return calls
+
+
+def run(output_dir, **kwargs):
+    scheduler = fetch_scheduler.FetchScheduler(
+        f'{output_dir}/processing.json', f'{output_dir}/master.json', 'key', output_dir, **kwargs
+    )
+    return scheduler.run(wait=True, timeout=5)
+
+
+def test_polled_success_is_indexed_in_catalog(output_dir, monkeypatch):
+    queue_job(output_dir, 5)
+    fake_api(monkeypatch, {5: {'id': 5, 'status': 'success', 'output': ['https://cdn/5.png']}})
+
+    assert run(output_dir) == 1
+
+    records = list(OutputCatalog.open(f'{output_dir}/catalog.db').query(strength=0.6, prompt='a cat'))
+    assert [r['id'] for r in records] == [5]
+    assert records[0]['local_paths'] == [os.path.join(output_dir, '5', '5.png')]
+    assert json_utils.read_records(f'{output_dir}/processing.json') == []
+    assert json_utils.lookup_record(f'{output_dir}/master.json', 5)['meta']['seed'] == 1
+
+
+def test_failed_job_is_dropped_without_retrying(output_dir, monkeypatch):
+    queue_job(output_dir, 6)
+    calls = fake_api(monkeypatch, {6: {'id': 6, 'status': 'failed', 'message': 'NSFW'}})
+
+    assert run(output_dir) == 0
+
+    assert calls == [6]
+    assert json_utils.read_records(f'{output_dir}/processing.json') == []
+    assert OutputCatalog.open(f'{output_dir}/catalog.db').get(6)['status'] == 'failed'
+
+
+def test_jobs_queued_during_a_run_are_kept_and_polled(output_dir, monkeypatch):
+    queue_job(output_dir, 1)
+    responses = {
+        1: {'id': 1, 'status': 'success', 'output': []},
+        2: {'id': 2, 'status': 'success', 'output': []},
+    }
+    calls = fake_api(monkeypatch, responses)
+    send_request = fetch_scheduler.send_request
+
+    def send_request_and_queue(id, api_key):
+        if id == 1:
+            queue_job(output_dir, 2)  # the sweep appends a new job while this batch is in flight
+        return send_request(id, api_key)
+
+    monkeypatch.setattr(fetch_scheduler, 'send_request', send_request_and_queue)
+
+    assert run(output_dir) == 2
+    assert calls == [1, 2]
+    assert json_utils.read_records(f'{output_dir}/processing.json') == []
+
+
+def test_fetch_processed_image_accepts_deprecated_pause(output_dir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(image_processor, 'fetch_images', lambda *args, **kwargs: calls.append(kwargs))
+    processor = image_processor.ImageProcessor('key', processing_json_path=f'{output_dir}/processing.json')
+    queue_job(output_dir, 3, eta=60)
+
+    with pytest.warns(DeprecationWarning):
+        processor.fetch_processed_image(f'{output_dir}/master.json', pause=True, pause_sec=20)
+
+    assert calls[0]['wait'] is True and calls[0]['timeout'] == 20
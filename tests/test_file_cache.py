@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from src.utils.catalog import OutputCatalog
+from src.utils.file_cache import atomic_write, evict_lru
+from src.utils.image_upload import UploadLedger
+from src.utils.request_cache import RequestCache
+
+
+def test_open_shares_one_instance_per_class_and_path(tmp_path):
+    db_path = tmp_path / 'store.db'
+    assert OutputCatalog.open(db_path) is OutputCatalog.open(str(db_path))
+    assert UploadLedger.open(tmp_path / 'ledger.db') is not OutputCatalog.open(db_path)
+    assert isinstance(UploadLedger.open(tmp_path / 'ledger.db'), UploadLedger)
+
+
+def test_atomic_write_keeps_old_file_on_error(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text('old')
+
+    def fail(tmp_path):
+        open(tmp_path, 'w').write('partial')
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        atomic_write(path, fail)
+
+    assert path.read_text() == 'old'
+    assert os.listdir(tmp_path) == ['manifest.json']
+
+
+def test_evict_lru_removes_least_recently_used(tmp_path):
+    for i, name in enumerate(['old', 'mid', 'new']):
+        path = tmp_path / name
+        path.write_bytes(b'x' * 10)
+        os.utime(path, (i, i))
+
+    assert evict_lru(tmp_path.iterdir(), 20) == 20
+    assert sorted(os.listdir(tmp_path)) == ['mid', 'new']
+
+
+def test_request_cache_round_trip(tmp_path):
+    cache = RequestCache(tmp_path / 'cache')
+    image = tmp_path / '1.png'
+    image.write_bytes(b'png')
+    payload = {'prompt': 'a cat', 'seed': 1, 'key': 'secret'}
+
+    cache.put(payload, {'id': 1, 'status': 'success'}, [str(image)])
+
+    assert cache.get({**payload, 'key': 'other'})['local_paths'] == [str(image)]
+    assert cache.get({**payload, 'seed': None}) is None
@@ -0,0 +1,59 @@
+import threading
+
+from src.utils import json_utils
+
+
+def test_remove_record_keeps_concurrent_appends(tmp_path):
+    path = tmp_path / 'processing.json'
+    json_utils.append_to_jsonl({'id': 'done'}, path)
+
+    def append(start):
+        for i in range(start, start + 100):
+            json_utils.append_to_jsonl({'id': i}, path)
+
+    def remove():
+        for i in range(50):
+            json_utils.remove_record(path, 'done')
+            json_utils.append_to_jsonl({'id': 'done'}, path)
+
+    threads = [threading.Thread(target=append, args=(i * 100,)) for i in range(4)]
+    threads.append(threading.Thread(target=remove))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = [r['id'] for r in json_utils.iter_records(path)]
+    assert sorted(i for i in ids if i != 'done') == list(range(400))
+    assert json_utils.lookup_record(path, 399) == {'id': 399}
+
+
+def test_tombstoned_key_is_not_appended_again(tmp_path):
+    path = tmp_path / 'processing.json'
+    json_utils.append_to_jsonl({'id': 1}, path)
+    json_utils.remove_record(path, 1, tombstone=True)
+
+    assert json_utils.append_to_jsonl({'id': 1}, path) is False
+    assert json_utils.read_records(path) == []
+
+
+def test_queued_removals_from_many_threads(tmp_path):
+    path = tmp_path / 'processing.json'
+    for i in range(20):
+        json_utils.append_to_jsonl({'id': i}, path)
+
+    threads = [threading.Thread(target=json_utils.queue_removal, args=(path, [i])) for i in range(0, 20, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [r['id'] for r in json_utils.iter_records(path)] == list(range(1, 20, 2))
+
+
+def test_rewrite_records_leaves_no_temp_files(tmp_path):
+    path = tmp_path / 'master.json'
+    json_utils.rewrite_records([{'id': i} for i in range(3)], path)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['master.json', 'master.json.idx']
+    assert json_utils.lookup_record(path, 2) == {'id': 2}
@@ -0,0 +1,33 @@
+import json
+
+import requests
+
+from src.utils import rate_limiter
+
+
+def make_response(body, status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode() if not isinstance(body, bytes) else body
+    return response
+
+
+def test_429_is_rate_limited():
+    assert rate_limiter.is_rate_limited(make_response({}, 429))
+
+
+def test_error_body_is_rate_limited():
+    assert rate_limiter.is_rate_limited(make_response({'status': 'error', 'message': 'Rate limit exceeded'}))
+
+
+def test_success_echoing_the_phrase_is_not_rate_limited():
+    body = {'status': 'success', 'output': ['https://cdn/1.png'], 'meta': {'prompt': 'a sign that says rate limit'}}
+    assert not rate_limiter.is_rate_limited(make_response(body))
+
+
+def test_body_is_ignored_without_inspect_body():
+    assert not rate_limiter.is_rate_limited(make_response({'status': 'error', 'message': 'rate limit'}), inspect_body=False)
+
+
+def test_non_json_body_is_checked_as_text():
+    assert rate_limiter.is_rate_limited(make_response(b'<html>Rate limit reached</html>'))
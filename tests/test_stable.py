@@ -0,0 +1,149 @@
+import os
+import threading
+
+import pytest
+import requests
+
+from src import stable
+from src.utils import fetch_scheduler, json_utils
+from src.utils.request_cache import RequestCache
+from src.utils.response_processor import ResponseProcessor
+from src.utils.sweep_journal import SweepJournal
+from src.utils.webhook_server import WebhookServer
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(stable, 'ImageUploader', lambda: None)
+    monkeypatch.setattr(stable.StableAPI, 'OUTPUT_DIR', f'{tmp_path}/')
+    return stable.StableAPI(api_key='key')
+
+
+def test_repoll_skips_job_completed_since_the_crash(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(stable, 'send_request', lambda id, api_key: pytest.fail('completed job was polled again'))
+    json_utils.append_to_jsonl({'id': 9, 'status': 'success', 'output': []}, tmp_path / 'master.json')
+
+    journal = SweepJournal(tmp_path / 'sweep.jsonl')
+    combo = {'call': 'img2img', 'seed': 1}
+    journal.record_response(combo, {'id': 9, 'status': 'processing'})
+
+    response = api._dispatch(combo, journal)
+    api.process_responses([response])
+
+    assert response['resumed'] and journal.is_completed(combo)
+    assert [r['id'] for r in json_utils.iter_records(tmp_path / 'master.json')] == [9]
+
+
+def test_repoll_processes_job_finished_while_stopped(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(stable, 'send_request', lambda id, api_key: {'id': id, 'status': 'success', 'output': []})
+    ResponseProcessor({'id': 4, 'status': 'processing', 'eta': 10, 'meta': {'seed': 2}}, f'{tmp_path}/').process()
+
+    response = api._repoll(4)
+    api.process_responses([response])
+
+    assert json_utils.read_records(tmp_path / 'processing.json') == []
+    assert json_utils.lookup_record(tmp_path / 'master.json', 4)['meta'] == {'seed': 2}
+
+
+@pytest.mark.parametrize('completion', ['scheduler', 'webhook'])
+def test_processing_job_is_cached_once_fetched(api, tmp_path, monkeypatch, completion):
+    api.cache = RequestCache(tmp_path / 'cache')
+    processing = {'id': 3, 'status': 'processing', 'eta': 0, 'meta': {'seed': 5}}
+    monkeypatch.setattr(api, '_make_request', lambda url, body: dict(processing))
+    monkeypatch.setattr(stable.StableAPI, 'CONFIG_PATH', str(tmp_path))
+    (tmp_path / 'img2img.yml').write_text('seed: 5\n')
+
+    api.process_responses([api.request(call='img2img', prompt='a cat')])
+    assert not list((tmp_path / 'cache').glob('*/*.json'))
+
+    success = {'id': 3, 'status': 'success', 'output': ['https://cdn/3.png']}
+    image = tmp_path / '3' / '3.png'
+    if completion == 'scheduler':
+        monkeypatch.setattr(fetch_scheduler, 'send_request', lambda id, api_key: dict(success))
+        monkeypatch.setattr(fetch_scheduler, 'download_images', lambda urls, path: [str(image)])
+        fetch_scheduler.FetchScheduler(tmp_path / 'processing.json', tmp_path / 'master.json', 'key', str(tmp_path)).run()
+    else:
+        monkeypatch.setattr(ResponseProcessor, 'download_images', lambda self, urls, id: [str(image)])
+        WebhookServer(output_dir=f'{tmp_path}/').process_payload(dict(success))
+    image.parent.mkdir(exist_ok=True)
+    image.write_bytes(b'png')
+
+    monkeypatch.setattr(api, '_make_request', lambda url, body: pytest.fail('cached render was requested again'))
+    response = api.request(call='img2img', prompt='a cat')
+
+    assert response['cached'] and response['local_paths'] == [str(image)]
+    assert json_utils.read_records(tmp_path / 'processing.json') == []
+
+
+def test_timeout_fails_one_combo_not_the_sweep(api, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(stable.StableAPI, 'CONFIG_PATH', str(tmp_path))
+    (tmp_path / 'text2img.yml').write_text('seed: null\n')
+    (tmp_path / 'sweep.yml').write_text('call: text2img\nprompt: [a, slow, b]\n')
+
+    def post(url, json, **kwargs):
+        if json['prompt'] == 'slow':
+            raise requests.Timeout('read timed out')
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"id": 1, "status": "success", "output": []}'
+        return response
+
+    monkeypatch.setattr(stable.http_client, 'post', post)
+    combos = [{'call': 'text2img', 'prompt': prompt} for prompt in ('a', 'slow', 'b')]
+
+    responses = [response for _, response in api.iter_responses(combos, max_workers=2)]
+
+    assert responses[1] is None
+    assert [r['status'] for r in (responses[0], responses[2])] == ['success', 'success']
+
+    api.debug = True
+    api.yaml_path = str(tmp_path / 'sweep.yml')
+    api.run(max_workers=2)
+
+    assert capsys.readouterr().out.count('Request failed') == 1
+    assert json_utils.lookup_record(tmp_path / 'master.json', 1)['status'] == 'success'
+
+    responses, status = api.get_responses({'call': ['text2img'], 'prompt': ['slow', 'a']})
+    assert responses[0] is None and status == 'success'
+
+
+@pytest.mark.parametrize('wait', [True, False])
+def test_upload_images_uploads_each_path_once_and_closes_bar(api, tmp_path, monkeypatch, wait):
+    bars, uploads, release = [], [], threading.Event()
+
+    class Bar:
+        def __init__(self, total, **kwargs):
+            self.total, self.n, self.closed = total, 0, threading.Event()
+            bars.append(self)
+
+        def update(self):
+            self.n += 1
+
+        def close(self):
+            self.closed.set()
+
+    class Uploader:
+        def upload_img(self, path):
+            release.wait(5)
+            uploads.append(path)
+            return f'https://cdn/{os.path.basename(path)}'
+
+    for name in ('a.png', 'b.png'):
+        (tmp_path / name).write_bytes(b'')
+    a, b = str(tmp_path / 'a.png'), str(tmp_path / 'b.png')
+    monkeypatch.setattr(stable, 'tqdm', Bar)
+    api.uploader = Uploader()
+    options = {'init_image': [a, b, a], 'mask_image': b}
+
+    if wait:
+        release.set()
+    api.upload_images(options, ['init_image', 'mask_image'], wait=wait)
+    assert bars[0].closed.is_set() == wait
+    release.set()
+
+    results = {key: [f.result() if hasattr(f, 'result') else f for f in value] for key, value in options.items()}
+    assert results == {'init_image': ['https://cdn/a.png', 'https://cdn/b.png', 'https://cdn/a.png'],
+                       'mask_image': ['https://cdn/b.png']}
+    assert sorted(uploads) == [a, b]
+    assert bars[0].closed.wait(5)  # in pipeline mode, by the last upload's callback
+    assert bars[0].total == 2 and bars[0].n == 2
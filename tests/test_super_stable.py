@@ -0,0 +1,94 @@
+import threading
+from collections import Counter
+
+from src import super_stable
+
+
+class CountingSemaphore(threading.BoundedSemaphore):
+    def __init__(self, value=1):
+        super().__init__(value)
+        self.acquired = self.released = 0
+
+    def acquire(self, *args, **kwargs):
+        self.acquired += 1
+        return super().acquire(*args, **kwargs)
+
+    def release(self, *args, **kwargs):
+        self.released += 1
+        return super().release(*args, **kwargs)
+
+
+class FakeProgressBar:
+    def __init__(self, total, **kwargs):
+        self.total = total
+        self.finished = []
+        self.closed = False
+
+    def set_postfix(self, postfix):
+        self.finished.append((postfix['File'], postfix['Status']))
+
+    def update(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeImageUploader:
+    def upload_img(self, path):
+        name = path.rsplit('/', 1)[-1]
+        return 'https://cdn/dup.jpg' if name.startswith('dup') else f'https://cdn/{name}'
+
+
+def test_process_batch_finishes_every_file_once(tmp_path, monkeypatch):
+    semaphores, bars = [], []
+
+    def make_semaphore(value):
+        semaphores.append(CountingSemaphore(value))
+        return semaphores[-1]
+
+    def make_bar(total, **kwargs):
+        bars.append(FakeProgressBar(total))
+        return bars[-1]
+
+    def submit(response_url):
+        name = response_url.rsplit('/', 1)[-1]
+        if name == 'err.jpg':
+            raise ValueError('bad response')
+        if name == 'slow.jpg':
+            return {'status': 'processing', 'eta': 0, 'fetch_result': 'https://api/fetch/slow'}
+        return {'status': 'success', 'output': [f'https://cdn/out/{name}']}
+
+    monkeypatch.setattr(super_stable, 'ImageUploader', FakeImageUploader)
+    monkeypatch.setattr(super_stable, 'tqdm', make_bar)
+    monkeypatch.setattr(super_stable, 'image_download', lambda url, path: path)
+    monkeypatch.setattr(threading, 'BoundedSemaphore', make_semaphore)
+
+    folder, output_dir = tmp_path / 'in', tmp_path / 'out'
+    folder.mkdir()
+    for name in ('skip', 'dup1', 'dup2', 'err', 'slow', 'ok'):
+        (folder / f'{name}.jpg').write_bytes(b'')
+    output_dir.mkdir()
+    (output_dir / 'skip_super.jpg').write_bytes(b'')
+
+    uploader = super_stable.APIUploader('key', output_dir=f'{output_dir}/')
+    uploader.submit = submit
+    uploader.poll = lambda api_response: {**api_response, 'status': 'success', 'output': ['https://cdn/out/slow.jpg']}
+
+    thread = threading.Thread(
+        target=uploader.process_batch, args=(str(folder),), kwargs={'max_in_flight': 2, 'poll_interval': 0.01}
+    )
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+    assert set(Counter(name for name, _ in bars[0].finished).values()) == {1}
+    finished = dict(bars[0].finished)
+    assert len(finished) == 6 and bars[0].closed
+    assert {name: finished[name] for name in ('skip.jpg', 'err.jpg', 'slow.jpg', 'ok.jpg')} == {
+        'skip.jpg': 'Skipped', 'err.jpg': 'error', 'slow.jpg': 'success', 'ok.jpg': 'success'
+    }
+    assert sorted((finished['dup1.jpg'], finished['dup2.jpg'])) == ['Skipped', 'success']
+
+    in_flight = semaphores[0]
+    assert in_flight.acquired == in_flight.released == 5
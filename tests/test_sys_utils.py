@@ -0,0 +1,56 @@
+import os
+import zipfile
+
+import pytest
+
+from src.utils import sys_utils
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'images'
+    (folder / '1' / 'json').mkdir(parents=True)
+    (folder / 'master.json').write_text('{"id": 1, "status": "success"}\n' * 2000)
+    (folder / '1' / 'json' / '1.json').write_text('{"prompt": "a cat"}' * 500)
+    for i in range(6):
+        (folder / '1' / f'{i}.png').write_bytes(os.urandom(30000))
+    (folder / 'empty.txt').write_bytes(b'')
+    return folder
+
+
+def contents(folder):
+    return {str(p.relative_to(folder)): p.read_bytes() for p in folder.rglob('*') if p.is_file()}
+
+
+def unzip(archives):
+    entries = {}
+    for archive in archives:
+        with zipfile.ZipFile(archive) as zipf:
+            assert zipf.testzip() is None
+            for info in zipf.infolist():
+                entries[info.filename] = (zipf.read(info), info.compress_type)
+    return entries
+
+
+def test_precompressed_entries_are_supported():
+    assert sys_utils._supports_precompressed()
+
+
+@pytest.mark.parametrize('parallel', [True, False])
+def test_zip_folder_round_trip(folder, tmp_path, monkeypatch, parallel):
+    monkeypatch.setattr(sys_utils, '_supports_precompressed', lambda: parallel)
+
+    archives = sys_utils.zip_folder(folder, tmp_path / 'images.zip', workers=2)
+    entries = unzip(archives)
+
+    assert {name: data for name, (data, _) in entries.items()} == contents(folder)
+    assert entries['1/0.png'][1] == zipfile.ZIP_STORED
+    assert entries['master.json'][1] == zipfile.ZIP_DEFLATED
+
+
+def test_zip_folder_splits_into_complete_archives(folder, tmp_path):
+    archives = sys_utils.zip_folder(folder, tmp_path / 'images.zip', workers=2, split_size=70000)
+
+    assert len(archives) > 1
+    assert all(os.path.getsize(a) <= 70000 + 1024 for a in archives)  # plus the central directory
+    assert {name: data for name, (data, _) in unzip(archives).items()} == contents(folder)
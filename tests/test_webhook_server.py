@@ -0,0 +1,114 @@
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from src.utils import json_utils
+from src.utils.webhook_server import WebhookServer
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status
+
+
+def post_callbacks(url, payloads):
+    """Stand-in for the Stable API: posts each callback from its own thread, like concurrent jobs finishing."""
+    threads = [threading.Thread(target=post, args=(url, json.dumps(p).encode())) for p in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_callbacks_reach_handler():
+    received = []
+    with WebhookServer(host='127.0.0.1', port=0, handler=received.append) as server:
+        post_callbacks(server.url, [{'id': i, 'status': 'success'} for i in range(10)])
+        assert server.wait(range(10), timeout=5) == set()
+
+    assert sorted(p['id'] for p in received) == list(range(10))
+
+
+def test_wait_reports_missing_ids():
+    with WebhookServer(host='127.0.0.1', port=0, handler=lambda payload: None) as server:
+        post_callbacks(server.url, [{'id': 1, 'status': 'success'}])
+        assert server.wait([1, 2], timeout=0.5) == {'2'}
+
+
+def test_rejects_bad_requests():
+    with WebhookServer(host='127.0.0.1', port=0, handler=lambda payload: None) as server:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            post(server.url, b'not json')
+        assert error.value.code == 400
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(server.url, timeout=5)
+        assert error.value.code == 405
+
+
+def test_rejects_callbacks_without_the_token():
+    received = []
+    with WebhookServer(host='127.0.0.1', port=0, handler=received.append) as server:
+        for url in (server.url.rsplit('/', 1)[0], server.url.rsplit('/', 1)[0] + '/guess'):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                post(url, json.dumps({'id': 1, 'status': 'success'}).encode())
+            assert error.value.code == 403
+
+    assert received == []
+
+
+def test_rejects_oversized_body_before_reading_it():
+    with WebhookServer(host='127.0.0.1', port=0, handler=lambda payload: None, max_body=1024) as server:
+        with socket.create_connection((server.host, server.port), timeout=5) as conn:
+            conn.sendall(f'POST {server.path} HTTP/1.1\r\nContent-Length: 1000000000\r\n\r\n'.encode())
+            assert conn.recv(1024).startswith(b'HTTP/1.1 413')
+
+
+@pytest.mark.parametrize('payload', [
+    {'id': '../../escaped', 'status': 'success', 'output': [], 'meta': {}},
+    {'id': 'a/b', 'status': 'success'},
+    {'status': 'success'},
+    [{'id': 1}],
+])
+def test_rejects_ids_that_are_not_plain_tokens(tmp_path, payload):
+    received = []
+    with WebhookServer(host='127.0.0.1', port=0, output_dir=f'{tmp_path}/out/', handler=received.append) as server:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            post(server.url, json.dumps(payload).encode())
+        assert error.value.code == 400
+
+    assert received == []
+    assert [p.name for p in tmp_path.iterdir()] == []
+
+
+def test_success_removes_job_from_processing(tmp_path):
+    processing = tmp_path / 'processing.json'
+    for i in range(3):
+        json_utils.append_to_jsonl({'id': i, 'eta': 10}, processing)
+
+    with WebhookServer(host='127.0.0.1', port=0, output_dir=f'{tmp_path}/') as server:
+        post_callbacks(server.url, [{'id': 1, 'status': 'success', 'output': [], 'meta': {}}])
+        assert server.wait([1], timeout=5) == set()
+
+    assert [r['id'] for r in json_utils.iter_records(processing)] == [0, 2]
+    assert json_utils.lookup_record(tmp_path / 'master.json', 1)['status'] == 'success'
+
+
+def test_late_processing_record_is_not_appended(tmp_path, monkeypatch):
+    # The callback can arrive before the sweep has handled the job's initial 'processing' response
+    processing = tmp_path / 'processing.json'
+    json_utils.append_to_jsonl({'id': 3, 'eta': 10}, processing)
+    monkeypatch.setattr(json_utils, 'rewrite_records', lambda *args, **kwargs: pytest.fail('processing.json was rewritten'))
+
+    with WebhookServer(host='127.0.0.1', port=0, output_dir=f'{tmp_path}/') as server:
+        post_callbacks(server.url, [{'id': 7, 'status': 'success', 'output': [], 'meta': {}}])
+        assert server.wait([7], timeout=5) == set()
+
+    assert json_utils.append_to_jsonl({'id': 7, 'eta': 10}, processing) is False
+    assert json_utils.append_to_jsonl({'id': 8, 'eta': 10}, processing) is True
+    assert [r['id'] for r in json_utils.iter_records(processing)] == [3, 8]